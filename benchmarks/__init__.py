@@ -0,0 +1,6 @@
+"""
+Benchmarks for AdlerManager, run them from the repository root, e.g.:
+
+    PYTHONPATH=src python -m benchmarks.startup
+    PYTHONPATH=src python -m benchmarks.pipeline --output results.json
+"""
@@ -0,0 +1,76 @@
+"""
+Compare results of L{benchmarks.pipeline} against a baseline.
+
+Stages whose time per operation grew by more than the threshold are
+flagged as regressions, and the exit status is 1 if there are any.
+
+Usage:
+
+    PYTHONPATH=src python -m benchmarks.pipeline --output baseline.json
+    # ... change things ...
+    PYTHONPATH=src python -m benchmarks.pipeline --output results.json
+    PYTHONPATH=src python -m benchmarks.compare baseline.json results.json
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List
+
+from .pipeline import RESULTS_VERSION
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        results: Dict[str, Any] = json.load(f)
+    if results.get("version") != RESULTS_VERSION:
+        raise SystemExit(f"{path}: unsupported results version")
+    return results
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> List[str]:
+    """
+    Print a comparison table and return the stages that regressed.
+    """
+    if baseline["parameters"] != current["parameters"]:
+        print("Warning: results were taken with different parameters")
+    regressions = []
+    print(f"{'stage':<24} {'baseline':>9} {'current':>9} {'change':>8}")
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<24} {'-':>9} {result['us_per_op']:>9.2f}")
+            continue
+        before = baseline["results"][name]["us_per_op"]
+        after = result["us_per_op"]
+        change = after / before - 1 if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:<24} {before:>9.2f} {after:>9.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare benchmark results against a baseline"
+    )
+    parser.add_argument("baseline", help="Results to compare against")
+    parser.add_argument("current", help="New results")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Slowdown, as a fraction of the baseline, that is a regression",
+    )
+    args = parser.parse_args(argv)
+    regressions = compare(load(args.baseline), load(args.current), args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
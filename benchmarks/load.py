@@ -0,0 +1,334 @@
+"""
+End-to-end HTTP load for AdlerManager.
+
+Alerts are POSTed for every site every --interval seconds, as Alertmanager
+would, while status pages are requested for random sites at --get-rate
+requests per second.
+Throughput and latency percentiles are reported per endpoint for every
+combination of --sites, --services and --alerts.
+
+By default AdlerManager runs in-process on synthetic sites (see
+L{benchmarks.synthetic}); client and server share the reactor then, so
+latencies include the client's overhead.
+With --url, a running instance is used instead and sites and their tokens
+are read from --data-dir; the alerts sent are still synthetic, so they
+likely match no component and are filtered out after being parsed.
+
+Usage:
+
+    PYTHONPATH=src python -m benchmarks.load --sites 10 100 1000 --alerts 20
+    PYTHONPATH=src python -m benchmarks.load --url http://localhost:8080 \\
+        --data-dir data --duration 60
+"""
+
+import argparse
+import heapq
+import io
+import json
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from twisted.internet import defer, protocol, reactor, task
+from twisted.internet.interfaces import IListeningPort
+from twisted.python.filepath import FilePath
+from twisted.web import client, server
+from twisted.web.http_headers import Headers
+
+from adlermanager.Config import ConfigClass
+from adlermanager.SitesManager import SitesManager
+from adlermanager.utils import read_tokens
+from adlermanager.WebRoot import BoundedRequest, web_root
+from .synthetic import make_batches, make_sites
+
+# How often the load is driven, in seconds
+TICK = 0.01
+
+
+class Endpoint(object):
+    """
+    Latencies and status codes of the requests to an endpoint.
+    """
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.codes: Dict[int, int] = {}
+        self.failures = 0
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+class Load(object):
+    """
+    Drive requests against url until stop is called.
+
+    @ivar sites: Site name -> token.
+    """
+
+    def __init__(
+        self,
+        url: bytes,
+        sites: Dict[str, str],
+        args: argparse.Namespace,
+        alerts: int,
+        services: int,
+    ) -> None:
+        self.url = url
+        self.sites = sites
+        self.args = args
+        self.pool = client.HTTPConnectionPool(reactor)
+        self.pool.maxPersistentPerHost = args.connections
+        self.agent = client.Agent(reactor, pool=self.pool)
+        self.endpoints = {"GET /": Endpoint(), "POST /api/v1/alerts": Endpoint()}
+        self.in_flight: List[defer.Deferred[Any]] = []
+        # Payloads for each site, they change a bit on each delivery
+        self.payloads = {
+            site: [
+                json.dumps(
+                    {"version": "4", "status": "firing", "alerts": batch}
+                ).encode("utf-8")
+                for batch in make_batches(
+                    site, alerts, 4, churn=args.churn, services=services
+                )
+            ]
+            for site in sites
+        }
+        self.deliveries: Dict[str, int] = {site: 0 for site in sites}
+        # (when, site): the next delivery for each site, spread over an interval
+        self.schedule = [
+            (args.interval * n / len(sites), site) for n, site in enumerate(sites)
+        ]
+        heapq.heapify(self.schedule)
+        self.gets = 0
+        self.started = 0.0
+        self.loop = task.LoopingCall(self.tick)
+
+    def start(self) -> None:
+        self.started = time.monotonic()
+        _ = self.loop.start(TICK)
+
+    def stop(self) -> defer.Deferred[Any]:
+        self.loop.stop()
+        return defer.DeferredList(list(self.in_flight))
+
+    def tick(self) -> None:
+        elapsed = time.monotonic() - self.started
+        while self.schedule and self.schedule[0][0] <= elapsed:
+            when, site = heapq.heappop(self.schedule)
+            self.post(site)
+            heapq.heappush(self.schedule, (when + self.args.interval, site))
+        due = int(elapsed * self.args.get_rate)
+        names = list(self.sites)
+        while self.gets < due:
+            self.gets += 1
+            self.request("GET /", b"GET", b"/", random.choice(names))
+
+    def post(self, site: str) -> None:
+        payloads = self.payloads[site]
+        payload = payloads[self.deliveries[site] % len(payloads)]
+        self.deliveries[site] += 1
+        self.request(
+            "POST /api/v1/alerts",
+            b"POST",
+            b"/api/v1/alerts",
+            site,
+            token=self.sites[site],
+            body=payload,
+        )
+
+    def request(
+        self,
+        endpoint: str,
+        method: bytes,
+        path: bytes,
+        host: str,
+        token: str = "",
+        body: Optional[bytes] = None,
+    ) -> None:
+        headers = Headers({b"Host": [host.encode("utf-8")]})
+        if token:
+            headers.addRawHeader(b"Authorization", f"Bearer {token}".encode("utf-8"))
+        producer = client.FileBodyProducer(io.BytesIO(body)) if body else None
+        stats = self.endpoints[endpoint]
+        started = time.monotonic()
+
+        def done(response: client.Response) -> defer.Deferred[None]:
+            def read(_: None) -> None:
+                stats.latencies.append(time.monotonic() - started)
+                stats.codes[response.code] = stats.codes.get(response.code, 0) + 1
+
+            finished: defer.Deferred[None] = defer.Deferred()
+            response.deliverBody(_Discard(finished))
+            return finished.addCallback(read)
+
+        def failed(_: Any) -> None:
+            stats.failures += 1
+
+        def forget(_: None) -> None:
+            self.in_flight.remove(d)
+
+        d: defer.Deferred[Any] = self.agent.request(
+            method, self.url + path, headers, producer
+        )
+        _ = d.addCallback(done).addErrback(failed).addCallback(forget)
+        self.in_flight.append(d)
+
+
+class _Discard(protocol.Protocol):
+    """
+    Read a response body, only to know when it is complete.
+    """
+
+    def __init__(self, finished: defer.Deferred[None]) -> None:
+        self.finished = finished
+
+    def connectionLost(self, reason: Any = None) -> None:
+        self.finished.callback(None)
+
+
+def read_sites(data_dir: FilePath) -> Dict[str, str]:
+    """
+    Return the name and first token of each site in data_dir.
+    """
+    sites = {}
+    for site_dir in sorted(data_dir.child("sites").children()):
+        tokens = read_tokens(site_dir.child("tokens.txt"))
+        if site_dir.isdir() and tokens:
+            sites[site_dir.basename()] = tokens[0]
+    return sites
+
+
+async def run_step(
+    args: argparse.Namespace,
+    url: bytes,
+    sites: Dict[str, str],
+    alerts: int,
+    services: int,
+) -> Dict[str, Dict[str, float]]:
+    load = Load(url, sites, args, alerts, services)
+    load.start()
+    await task.deferLater(reactor, args.duration, lambda: None)
+    elapsed = time.monotonic() - load.started
+    await load.stop()
+    await load.pool.closeCachedConnections()
+    return {
+        name: {
+            "requests": len(endpoint.latencies),
+            "failures": endpoint.failures
+            + sum(count for code, count in endpoint.codes.items() if code >= 400),
+            "rps": len(endpoint.latencies) / elapsed,
+            "p50": endpoint.percentile(0.5) * 1000,
+            "p95": endpoint.percentile(0.95) * 1000,
+            "p99": endpoint.percentile(0.99) * 1000,
+        }
+        for name, endpoint in load.endpoints.items()
+    }
+
+
+async def run_in_process(
+    args: argparse.Namespace, count: int, services: int, alerts: int
+) -> Dict[str, Dict[str, float]]:
+    tmp = FilePath(tempfile.mkdtemp(prefix="adlermanager-load-"))
+    port: Optional[IListeningPort] = None
+    try:
+        data_dir = tmp.child("data")
+        make_sites(data_dir, count, services=services)
+        sites_manager = SitesManager(
+            global_config=ConfigClass(data_dir=data_dir.path, state_snapshot_seconds=0)
+        )
+        site = server.Site(web_root(sites_manager), requestFactory=BoundedRequest)
+        port = reactor.listenTCP(0, site, interface="127.0.0.1")  # type: ignore
+        address = port.getHost()
+        url = f"http://127.0.0.1:{address.port}".encode("utf-8")  # type: ignore
+        results = await run_step(args, url, read_sites(data_dir), alerts, services)
+        await sites_manager.stop()
+        return results
+    finally:
+        if port is not None:
+            await defer.maybeDeferred(port.stopListening)
+        shutil.rmtree(tmp.path)
+
+
+def report(step: Tuple[int, int, int], results: Dict[str, Dict[str, float]]) -> None:
+    sites, services, alerts = step
+    for name, r in results.items():
+        print(
+            f"{sites:>6} {services:>8} {alerts:>6} {name:<20} {r['requests']:>8.0f} "
+            f"{r['failures']:>6.0f} {r['rps']:>8.1f} {r['p50']:>8.2f} "
+            f"{r['p95']:>8.2f} {r['p99']:>8.2f}"
+        )
+
+
+async def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="HTTP load for AdlerManager")
+    parser.add_argument(
+        "--url", help="Use a running instance instead of starting one in-process"
+    )
+    parser.add_argument(
+        "--data-dir", help="With --url, the instance's DATA_DIR, to find sites"
+    )
+    parser.add_argument(
+        "--sites", type=int, nargs="+", default=[10, 100], help="Amount of sites"
+    )
+    parser.add_argument(
+        "--services", type=int, nargs="+", default=[5], help="Services per site"
+    )
+    parser.add_argument(
+        "--alerts", type=int, nargs="+", default=[20], help="Alerts per batch"
+    )
+    parser.add_argument(
+        "--churn", type=float, default=0.1, help="Fraction of alerts that change"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=10.0, help="Seconds between POSTs per site"
+    )
+    parser.add_argument(
+        "--get-rate", type=float, default=50.0, help="Status page GETs per second"
+    )
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per step")
+    parser.add_argument(
+        "--connections", type=int, default=20, help="Persistent connections to keep"
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'sites':>6} {'services':>8} {'alerts':>6} {'endpoint':<20} "
+        f"{'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8}"
+    )
+    steps: List[Dict[str, Any]] = []
+    if args.url:
+        if not args.data_dir:
+            parser.error("--url needs --data-dir")
+        sites = read_sites(FilePath(args.data_dir))
+        for alerts in args.alerts:
+            step = (len(sites), args.services[0], alerts)
+            results = await run_step(
+                args, args.url.encode("utf-8"), sites, alerts, args.services[0]
+            )
+            report(step, results)
+            steps.append({"step": step, "results": results})
+    else:
+        for count in args.sites:
+            for services in args.services:
+                for alerts in args.alerts:
+                    step = (count, services, alerts)
+                    results = await run_in_process(args, count, services, alerts)
+                    report(step, results)
+                    steps.append({"step": step, "results": results})
+    if args.output:
+        FilePath(args.output).setContent(
+            json.dumps(steps, indent=2).encode("utf-8") + b"\n"
+        )
+
+
+if __name__ == "__main__":
+    task.react(lambda _, argv: defer.ensureDeferred(main(argv)), [sys.argv[1:]])
@@ -0,0 +1,84 @@
+"""
+How much memory alerts take.
+
+Alerts are decoded from separate payloads, as they would arrive over time,
+and kept, as in L{IncidentManager.active_alerts}.
+They are measured as:
+  - plain: an unslotted class keeping the decoded labels and annotations,
+    as alerts used to be kept.
+  - alert: L{Alert.import_alert}.
+
+Usage:
+
+    PYTHONPATH=src python -m benchmarks.memory --alerts 10000
+"""
+
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import attr
+
+from adlermanager.model import Alert, Severity
+from .synthetic import make_alert
+
+
+@attr.s
+class PlainAlert:
+    labels: Dict[str, str] = attr.ib(factory=dict)
+    annotations: Dict[str, str] = attr.ib(factory=dict)
+    endsAt: Optional[Any] = attr.ib(default=None)
+    startsAt: Optional[Any] = attr.ib(default=None)
+    status: Severity = attr.ib(default=Severity.OK)
+    fingerprint: str = attr.ib(default="")
+
+
+def plain(d: Dict[str, Any]) -> Any:
+    alert = PlainAlert(
+        labels=d["labels"], annotations=d["annotations"], fingerprint=d["fingerprint"]
+    )
+    # Dates and status are the same as with Alert
+    reference = Alert.import_alert(d)
+    alert.startsAt = reference.startsAt
+    alert.endsAt = reference.endsAt
+    alert.status = reference.status
+    return alert
+
+
+def measure(count: int, convert: Callable[[Dict[str, Any]], Any]) -> float:
+    """
+    @return: Bytes per alert.
+    """
+    payloads = [
+        json.dumps(make_alert("site-0.example.org", n % 5, n % 4, n)).encode("utf-8")
+        for n in range(count)
+    ]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    alerts: List[Any] = [convert(json.loads(payload)) for payload in payloads]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(alerts) == count
+    return (after - before) / count
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark memory used by alerts")
+    parser.add_argument(
+        "--alerts", type=int, nargs="+", default=[10000], help="Amount of alerts"
+    )
+    args = parser.parse_args(argv)
+    print(f"{'alerts':>8} {'plain B/alert':>14} {'alert B/alert':>14} {'saved':>7}")
+    for count in args.alerts:
+        before = measure(count, plain)
+        after = measure(count, Alert.import_alert)
+        print(f"{count:>8} {before:>14.0f} {after:>14.0f} {1 - after / before:>7.1%}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,274 @@
+"""
+How long each stage of the alert pipeline takes.
+
+Stages:
+  - import_alert: converting raw alerts with L{Alert.import_alert}.
+  - site_process_alerts: L{SiteManager.process_alerts}, alerts for a site.
+  - incident_process_alerts: L{IncidentManager.process_alerts}, alerts that
+    were already routed to a service.
+  - status: reading the status of a site, its services and their
+    components, as a status page does, with an active incident.
+  - render: rendering a status page with an active incident.
+  - reload_unchanged: L{SitesManager.reload} when no site changed.
+  - reload_changed: L{SitesManager.reload} when a fraction churn of the
+    sites changed.
+
+AdlerManager's own time is driven by a L{task.Clock}, so deadlines behave
+the same in every run, and only the time spent in the stage is measured.
+
+Usage:
+
+    PYTHONPATH=src python -m benchmarks.pipeline --output results.json
+    PYTHONPATH=src python -m benchmarks.compare baseline.json results.json
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from twisted.internet import task
+from twisted.python.filepath import FilePath
+
+from adlermanager.Config import ConfigClass
+from adlermanager.IncidentManager import IncidentManager
+from adlermanager.model import Alert
+from adlermanager.Persistence import Persistence
+from adlermanager.Scheduler import Scheduler
+from adlermanager.SitesManager import SitesManager
+from .synthetic import make_batches, make_sites, site_name
+
+RESULTS_VERSION = 1
+
+# Seconds of virtual time between batches, as with Alertmanager's
+# group_interval
+BATCH_INTERVAL = 30.0
+
+Stage = Callable[[argparse.Namespace, FilePath], Tuple[float, int]]
+"""Returns the seconds taken and the amount of operations done"""
+
+
+def make_config(data_dir: FilePath) -> ConfigClass:
+    return ConfigClass(
+        data_dir=data_dir.path,
+        persistence_threads=0,
+        journal_fsync=False,
+        state_snapshot_seconds=0,
+    )
+
+
+def make_sites_manager(data_dir: FilePath) -> Tuple[SitesManager, task.Clock]:
+    clock = task.Clock()
+    manager = SitesManager(
+        global_config=make_config(data_dir), scheduler=Scheduler(clock=clock)
+    )
+    return manager, clock
+
+
+def batches(args: argparse.Namespace) -> List[List[Dict[str, Any]]]:
+    return make_batches(
+        site_name(0),
+        args.alerts,
+        args.rounds,
+        churn=args.churn,
+        services=args.services,
+        components=args.components,
+    )
+
+
+def import_alert(args: argparse.Namespace, data_dir: FilePath) -> Tuple[float, int]:
+    raw_batches = batches(args)
+    started = time.perf_counter()
+    for batch in raw_batches:
+        for ra in batch:
+            Alert.import_alert(ra)
+    return time.perf_counter() - started, args.alerts * args.rounds
+
+
+def site_process_alerts(
+    args: argparse.Namespace, data_dir: FilePath
+) -> Tuple[float, int]:
+    raw_batches = batches(args)
+    manager, clock = make_sites_manager(data_dir)
+    site = manager.site_managers[site_name(0)]
+    elapsed = 0.0
+    for batch in raw_batches:
+        started = time.perf_counter()
+        site.process_alerts(batch)
+        elapsed += time.perf_counter() - started
+        clock.advance(BATCH_INTERVAL)
+    site.stop()
+    return elapsed, args.alerts * args.rounds
+
+
+def incident_process_alerts(
+    args: argparse.Namespace, data_dir: FilePath
+) -> Tuple[float, int]:
+    alert_batches = [
+        [Alert.import_alert(ra) for ra in batch] for batch in batches(args)
+    ]
+    clock = task.Clock()
+    incident = IncidentManager(
+        global_config=make_config(data_dir),
+        path=data_dir.child("incident"),
+        scheduler=Scheduler(clock=clock),
+        persistence=Persistence(threads=0),
+    )
+    elapsed = 0.0
+    for batch in alert_batches:
+        started = time.perf_counter()
+        incident.process_alerts(batch, "")
+        elapsed += time.perf_counter() - started
+        clock.advance(BATCH_INTERVAL)
+    incident.stop()
+    return elapsed, args.alerts * args.rounds
+
+
+def status(args: argparse.Namespace, data_dir: FilePath) -> Tuple[float, int]:
+    manager, _ = make_sites_manager(data_dir)
+    site = manager.site_managers[site_name(0)]
+    site.process_alerts(batches(args)[0])
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        site.status
+        for service in site.service_managers.values():
+            service.status
+            service.components
+    elapsed = time.perf_counter() - started
+    site.stop()
+    return elapsed, args.rounds
+
+
+def render(args: argparse.Namespace, data_dir: FilePath) -> Tuple[float, int]:
+    manager, _ = make_sites_manager(data_dir)
+    site = manager.site_managers[site_name(0)]
+    site.process_alerts(batches(args)[0])
+    template = site.template
+    # Compile the template before measuring
+    template.render(site=site)
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        template.render(site=site)
+    elapsed = time.perf_counter() - started
+    site.stop()
+    return elapsed, args.rounds
+
+
+def reload_unchanged(args: argparse.Namespace, data_dir: FilePath) -> Tuple[float, int]:
+    manager, _ = make_sites_manager(data_dir)
+    started = time.perf_counter()
+    manager.reload()
+    return time.perf_counter() - started, args.sites
+
+
+def reload_changed(args: argparse.Namespace, data_dir: FilePath) -> Tuple[float, int]:
+    manager, _ = make_sites_manager(data_dir)
+    changed = max(1, int(args.sites * args.churn))
+    for n in range(changed):
+        site_yml = data_dir.child("sites").child(site_name(n)).child("site.yml")
+        # Appending to the file changes its size, so it's read again
+        site_yml.setContent(site_yml.getContent() + b"\n")
+    started = time.perf_counter()
+    manager.reload()
+    return time.perf_counter() - started, args.sites
+
+
+STAGES: Dict[str, Stage] = {
+    "import_alert": import_alert,
+    "site_process_alerts": site_process_alerts,
+    "incident_process_alerts": incident_process_alerts,
+    "status": status,
+    "render": render,
+    "reload_unchanged": reload_unchanged,
+    "reload_changed": reload_changed,
+}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Run the selected stages and return the results, see L{main}.
+    """
+    results: Dict[str, Any] = {}
+    for name in args.stages:
+        timings: List[float] = []
+        ops = 0
+        for _ in range(args.repeat):
+            # Every run gets fresh sites, so state doesn't carry over
+            tmp = FilePath(tempfile.mkdtemp(prefix="adlermanager-bench-"))
+            try:
+                data_dir = tmp.child("data")
+                make_sites(data_dir, args.sites, args.services, args.components)
+                seconds, ops = STAGES[name](args, data_dir)
+            finally:
+                shutil.rmtree(tmp.path)
+            timings.append(seconds)
+        best = min(timings)
+        results[name] = {
+            "ops": ops,
+            "best": best,
+            "median": statistics.median(timings),
+            "us_per_op": best / ops * 1e6,
+        }
+    return {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "parameters": {
+            "sites": args.sites,
+            "services": args.services,
+            "components": args.components,
+            "alerts": args.alerts,
+            "rounds": args.rounds,
+            "churn": args.churn,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the alert pipeline")
+    parser.add_argument("--sites", type=int, default=200, help="Amount of sites")
+    parser.add_argument("--services", type=int, default=5, help="Services per site")
+    parser.add_argument(
+        "--components", type=int, default=4, help="Components per service"
+    )
+    parser.add_argument("--alerts", type=int, default=200, help="Alerts per batch")
+    parser.add_argument("--rounds", type=int, default=20, help="Batches per run")
+    parser.add_argument(
+        "--churn",
+        type=float,
+        default=0.1,
+        help="Fraction of alerts, or sites, that change between batches",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per stage")
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=sorted(STAGES),
+        default=list(STAGES),
+        help="Stages to run",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    print(f"{'stage':<24} {'ops':>8} {'best s':>9} {'median s':>9} {'us/op':>9}")
+    for name, result in results["results"].items():
+        print(
+            f"{name:<24} {result['ops']:>8} {result['best']:>9.4f} "
+            f"{result['median']:>9.4f} {result['us_per_op']:>9.2f}"
+        )
+    if args.output:
+        FilePath(args.output).setContent(
+            json.dumps(results, indent=2).encode("utf-8") + b"\n"
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
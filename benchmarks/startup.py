@@ -0,0 +1,94 @@
+"""
+How long it takes to load many sites on startup.
+
+Scenarios:
+  - cold-python: no cache, YAML parsed with PyYAML's pure Python loader.
+  - cold-libyaml: no cache, YAML parsed with libyaml (if available).
+  - warm: parsed site definitions come from CACHE_DIR.
+  - lazy-warm: LAZY_SITES with its index in CACHE_DIR.
+
+Usage:
+
+    PYTHONPATH=src python -m benchmarks.startup --sites 1000 10000
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import yaml
+from twisted.internet import task
+from twisted.python.filepath import FilePath
+
+from adlermanager import utils
+from adlermanager.Config import ConfigClass
+from adlermanager.Scheduler import Scheduler
+from adlermanager.SitesManager import SitesManager
+from .synthetic import make_sites
+
+
+def load(data_dir: FilePath, cache_dir: str = "", lazy: bool = False) -> float:
+    """
+    @return: Seconds it took to load all sites.
+    """
+    config = ConfigClass(
+        data_dir=data_dir.path,
+        cache_dir=cache_dir,
+        persistence_threads=0,
+        lazy_sites=lazy,
+    )
+    started = time.perf_counter()
+    SitesManager(global_config=config, scheduler=Scheduler(clock=task.Clock()))
+    return time.perf_counter() - started
+
+
+def run(count: int) -> Dict[str, float]:
+    tmp = FilePath(tempfile.mkdtemp(prefix="adlermanager-bench-"))
+    try:
+        data_dir = tmp.child("data")
+        cache_dir = tmp.child("cache").path
+        make_sites(data_dir, count)
+        libyaml = getattr(yaml, "CSafeLoader", None)
+        scenarios: Dict[str, Callable[[], float]] = {}
+
+        def with_loader(loader: type) -> float:
+            default, utils.YamlLoader = utils.YamlLoader, loader
+            try:
+                return load(data_dir)
+            finally:
+                utils.YamlLoader = default
+
+        scenarios["cold-python"] = lambda: with_loader(yaml.SafeLoader)
+        if libyaml is not None:
+            scenarios["cold-libyaml"] = lambda: with_loader(libyaml)
+
+        # The first run fills the cache
+        _ = load(data_dir, cache_dir=cache_dir)
+        scenarios["warm"] = lambda: load(data_dir, cache_dir=cache_dir)
+        _ = load(data_dir, cache_dir=cache_dir, lazy=True)
+        scenarios["lazy-warm"] = lambda: load(data_dir, cache_dir=cache_dir, lazy=True)
+
+        return {name: scenario() for name, scenario in scenarios.items()}
+    finally:
+        shutil.rmtree(tmp.path)
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark loading sites")
+    parser.add_argument(
+        "--sites", type=int, nargs="+", default=[1000], help="Amount of sites"
+    )
+    args = parser.parse_args(argv)
+    print(f"{'sites':>8} {'scenario':<14} {'seconds':>9} {'ms/site':>9}")
+    for count in args.sites:
+        for name, seconds in run(count).items():
+            print(
+                f"{count:>8} {name:<14} {seconds:>9.3f} {seconds / count * 1000:>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
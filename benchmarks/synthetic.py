@@ -0,0 +1,117 @@
+"""
+Synthetic sites and alerts for benchmarks.
+"""
+
+from typing import Any, Dict, List
+
+import yaml
+from twisted.python.filepath import FilePath
+
+
+def site_name(n: int) -> str:
+    return f"site-{n}.example.org"
+
+
+def make_sites(
+    data_dir: FilePath, count: int, services: int = 5, components: int = 4
+) -> None:
+    """
+    Create count synthetic sites in data_dir, each with the given amount of
+    services and components per service.
+
+    Site n accepts alerts with the token token-n.
+    """
+    for n in range(count):
+        site = data_dir.child("sites").child(site_name(n))
+        site.makedirs(ignoreExistingDirectory=True)
+        definition = {
+            "title": f"Site {n}",
+            "url": f"https://{site_name(n)}",
+            "ssh_users": ["admin"],
+            "services": [
+                {
+                    "name": f"Service {s}",
+                    "label": f"service{s}",
+                    "description": "A service\nwith a longer description.\n",
+                    "components": [
+                        {
+                            "name": f"Component {c}",
+                            "label": f"component{c}",
+                            "description": "Something that can break",
+                        }
+                        for c in range(components)
+                    ],
+                }
+                for s in range(services)
+            ],
+        }
+        site.child("site.yml").setContent(
+            yaml.safe_dump(definition, allow_unicode=True).encode("utf-8")
+        )
+        site.child("tokens.txt").setContent(f"token-{n}\n".encode("utf-8"))
+
+
+def make_alert(
+    site: str, service: int, component: int, n: int, revision: int = 0
+) -> Dict[str, Any]:
+    """
+    Return an alert as sent by Alertmanager.
+
+    @param n: Tells apart alerts for the same component.
+    @param revision: Alerts with a different revision have the same
+        fingerprint, but changed.
+    """
+    return {
+        "status": "firing",
+        "labels": {
+            "adlermanager": site,
+            "service": f"service{service}",
+            "component": f"component{component}",
+            "severity": ("warning", "error")[n % 2],
+            "alertname": f"Alert{n}",
+            "instance": f"host{n}.example.org:9100",
+        },
+        "annotations": {
+            "summary": f"Alert {n} is firing",
+            "description": f"Something happened, revision {revision}",
+        },
+        "startsAt": "2024-01-01T00:00:00.000000000Z",
+        "endsAt": "0001-01-01T00:00:00Z",
+        "generatorURL": "http://prometheus.example.org/graph",
+        "fingerprint": f"{n:016x}",
+    }
+
+
+def make_batches(
+    site: str,
+    size: int,
+    rounds: int,
+    churn: float = 0.1,
+    services: int = 5,
+    components: int = 4,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Return rounds batches of size alerts for a site.
+
+    Alertmanager keeps sending active alerts, so every batch has the same
+    alerts, but a fraction churn of them changes from one batch to the next.
+    """
+    changed = int(size * churn)
+    batches = []
+    for r in range(rounds):
+        batch = []
+        for n in range(size):
+            # A different window of alerts changes each round, revision is
+            # how many windows alert n was in so far
+            revision = max(0, ((r + 1) * changed - n + size - 1) // size)
+            batch.append(
+                make_alert(
+                    site,
+                    (n // components) % services,
+                    n % components,
+                    n,
+                    revision,
+                )
+            )
+        batches.append(batch)
+    return batches
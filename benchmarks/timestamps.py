@@ -0,0 +1,141 @@
+"""
+Check L{read_timestamp} and L{Severity} lookups against the implementations
+they replaced, and time both.
+
+Timestamps are generated in the formats Alertmanager and Prometheus send:
+nanosecond, microsecond and millisecond fractions, with Z, and as
+L{Alert.export_alert} writes them.
+The former parser ignored UTC offsets, so timestamps with offsets are only
+checked against the instant they represent.
+Any mismatch is printed and the exit status is 1.
+
+Usage:
+
+    PYTHONPATH=src python -m benchmarks.timestamps --count 100000
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from adlermanager.model import Severity
+from adlermanager.utils import read_timestamp
+
+SEVERITIES = ["ok", "info", "warning", "error", "critical", "OK", "Critical"]
+
+
+def legacy_read_timestamp(s: str) -> datetime:
+    # We drop nanoseconds as python does not support that
+    return datetime.strptime(f"{s.split('.')[0]}+00:00", "%Y-%m-%dT%H:%M:%S%z")
+
+
+def legacy_from_string(s: str) -> Severity:
+    labels = {
+        "ok": Severity.OK,
+        "info": Severity.INFO,
+        "warning": Severity.WARNING,
+        "error": Severity.ERROR,
+        "critical": Severity.ERROR,
+    }
+    return labels[s.lower()]
+
+
+def make_timestamps(count: int, distinct: int) -> List[str]:
+    """
+    Return count UTC timestamps, with distinct different values, as a
+    batch of alerts would have them.
+    """
+    rng = random.Random(count)
+    base = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    values = []
+    for n in range(distinct):
+        t = base + timedelta(seconds=rng.randrange(10**8))
+        fraction = ["%09d" % rng.randrange(10**9), "%06d" % n, "%03d" % (n % 1000)]
+        values.append(f"{t:%Y-%m-%dT%H:%M:%S}.{fraction[n % 3]}Z")
+    return [values[rng.randrange(distinct)] for _ in range(count)]
+
+
+def check(count: int) -> List[str]:
+    """
+    @return: Descriptions of the mismatches.
+    """
+    errors = []
+    for s in make_timestamps(count, count):
+        expected = legacy_read_timestamp(s)
+        got = read_timestamp(s)
+        if got != expected or got.utcoffset() != expected.utcoffset():
+            errors.append(f"{s}: {got!r} != {expected!r}")
+    base = datetime(2020, 6, 1, 12, 30, 15, tzinfo=timezone.utc)
+    for minutes in (-720, -90, -30, 0, 60, 330, 840):
+        tz = timezone(timedelta(minutes=minutes))
+        local = base.astimezone(tz).isoformat(timespec="microseconds")
+        if read_timestamp(local) != base:
+            errors.append(f"{local}: {read_timestamp(local)!r} != {base!r}")
+    for bad in ["", "now", "2020-06-01", "2020-06-01T12:30:15", "2020-06-01T12:30Z"]:
+        try:
+            read_timestamp(bad)
+        except ValueError:
+            continue
+        errors.append(f"{bad!r} was accepted")
+    for name in SEVERITIES:
+        if Severity.from_string(name) is not legacy_from_string(name):
+            errors.append(f"Severity {name}: {Severity.from_string(name)!r}")
+    return errors
+
+
+def timed(f: Callable[[str], object], values: List[str]) -> float:
+    started = time.perf_counter()
+    for s in values:
+        f(s)
+    return time.perf_counter() - started
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark timestamp parsing")
+    parser.add_argument("--count", type=int, default=100000, help="Timestamps")
+    parser.add_argument(
+        "--distinct",
+        type=int,
+        default=1000,
+        help="Different timestamps among them, repeated ones hit the memo",
+    )
+    args = parser.parse_args(argv)
+
+    errors = check(min(args.count, 10000))
+    for error in errors:
+        print(error)
+
+    values = make_timestamps(args.count, args.distinct)
+    unique = make_timestamps(args.count, args.count)
+    legacy = timed(legacy_read_timestamp, values)
+    read_timestamp.cache_clear()
+    cold = timed(read_timestamp.__wrapped__, unique)
+    memo = timed(read_timestamp, values)
+    names = [SEVERITIES[n % len(SEVERITIES)] for n in range(args.count)]
+    print(f"{'case':<24} {'us/op':>9} {'speedup':>8}")
+    for name, seconds in [
+        ("strptime", legacy),
+        ("read_timestamp (parse)", cold),
+        ("read_timestamp (memo)", memo),
+    ]:
+        print(
+            f"{name:<24} {seconds / args.count * 1e6:>9.3f} "
+            f"{legacy / seconds:>7.1f}x"
+        )
+    legacy = timed(legacy_from_string, names)
+    print(f"{'severity (dict per call)':<24} {legacy / args.count * 1e6:>9.3f}")
+    seconds = timed(Severity.from_string, names)
+    print(
+        f"{'severity (table)':<24} {seconds / args.count * 1e6:>9.3f} "
+        f"{legacy / seconds:>7.1f}x"
+    )
+    if errors:
+        print(f"{len(errors)} mismatch(es)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
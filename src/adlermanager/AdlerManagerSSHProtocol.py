@@ -1,4 +1,5 @@
 import functools
+import math
 from typing import TYPE_CHECKING, Any, Dict, Optional, Union
 
 import attr
@@ -8,6 +9,7 @@ from twisted.python.filepath import FilePath
 
 from .conch_helpers import SSHSimpleAvatar, SSHSimpleProtocol
 from .model import SiteConfig
+from .Profiler import PROFILER
 
 if TYPE_CHECKING:
     from adlermanager.SitesManager import SiteManager, SitesManager
@@ -93,9 +95,7 @@ class AdlerManagerSSHProtocol(SSHSimpleProtocol):
                     self.terminal.nextLine()
                     return
             # Actually do something
-            sm.site_config = sc
-            sm.config_file.setContent(sc.to_YAML().encode("utf-8"))
-            sm.config_file.chmod(0o640)
+            await sm.set_site_config(sc)
             log.info(
                 "User {user} changed {site} config", user=self.user.username, site=site
             )
@@ -103,6 +103,55 @@ class AdlerManagerSSHProtocol(SSHSimpleProtocol):
                 self.terminal_write("Persisted SiteConfiguration")
                 self.terminal.nextLine()
 
+    def _require_profiling(self) -> None:
+        global_config = self.sites_manager.global_config
+        if not global_config.profiling:
+            raise PermissionError("Profiling is disabled, see PROFILING")
+        if self.user.username.decode("utf-8") not in global_config.ssh_admin_users:
+            raise PermissionError("Only SSH_ADMIN_USERS can profile")
+
+    def do_profile_start(self, seconds: bytes = b"", mode: bytes = b"sample") -> None:
+        """
+        Profile AdlerManager for a while, see profile_dump.
+        Modes are sample (default) and cprofile, which is slower but precise.
+        Usage: profile_start [seconds] [sample|cprofile]
+        """
+        self._require_profiling()
+        try:
+            duration = float(seconds) if seconds else 0.0
+        except ValueError:
+            raise SyntaxError("seconds must be a number")
+        if not math.isfinite(duration):
+            raise SyntaxError("seconds must be a finite number")
+        duration = PROFILER.start(duration, mode.decode("utf-8"))
+        log.info(
+            "User {user} started profiling for {seconds}s",
+            user=self.user.username,
+            seconds=duration,
+        )
+        self.terminal_write(f"Profiling for {duration:g}s")
+        self.terminal.nextLine()
+
+    def do_profile_stop(self) -> None:
+        """
+        Stop profiling before time. Usage: profile_stop
+        """
+        self._require_profiling()
+        PROFILER.stop()
+        self.terminal_write("Stopped profiling")
+        self.terminal.nextLine()
+
+    def do_profile_dump(self, output_format: bytes = b"collapsed") -> None:
+        """
+        Print the results of the current or last profile, as collapsed stacks
+        (e.g. for flamegraph.pl) or as a summary sorted by cumulative time.
+        Usage: profile_dump [collapsed|pstats]
+        """
+        self._require_profiling()
+        for line in PROFILER.dump(output_format.decode("utf-8")):
+            self.terminal_write(line)
+            self.terminal.nextLine()
+
     @functools.lru_cache()  # we don't need to re-read every time
     def motd(self) -> Union[str, bytes]:
         custom_motd = FilePath(self.sites_manager.global_config.data_dir).child(
@@ -1,15 +1,31 @@
+import hashlib
 import json
-from typing import TYPE_CHECKING, Any, Dict, List
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Union
 
-from twisted.internet import reactor, task
-from twisted.web._responses import BAD_REQUEST, OK
+from twisted.internet import defer
+from twisted.web._responses import BAD_REQUEST, OK, REQUEST_ENTITY_TOO_LARGE
 from twisted.web.server import Request
 
+from .metrics import Counter, Histogram
+from .model import Alert
 from .TokenResource import TokenResource
+from .utils import decode_json_cooperatively
 
 if TYPE_CHECKING:
     from .SitesManager import SiteManager, SitesManager
 
+PARSE_SECONDS = Histogram(
+    "adlermanager_webhook_parse_seconds",
+    "Time spent decoding alerts sent to us",
+    ["decoder"],
+)
+REJECTED = Counter(
+    "adlermanager_webhook_rejected_total",
+    "Requests with alerts that were rejected",
+    ["reason"],
+)
+
 
 class AdlerManagerTokenResource(TokenResource):
     """
@@ -23,29 +39,72 @@ class AdlerManagerTokenResource(TokenResource):
         @param site_manager: The object managing state for all sites.
         @type  site_manager: L{adlermanager.SitesManager}
         """
-        TokenResource.__init__(self, tokens=sites_manager.tokens)
+        TokenResource.__init__(self)
+        self.sites_manager = sites_manager
+        config = sites_manager.global_config
+        self.max_body_size = config.webhook_max_body_mb * 1024 * 1024
+        self.cooperative_decode_size = config.webhook_cooperative_decode_kb * 1024
+
+    @property
+    def tokens(self) -> Dict[str, Any]:
+        # SitesManager replaces its tokens when reloading
+        return self.sites_manager.tokens
+
+    @tokens.setter
+    def tokens(self, tokens: Dict[str, Any]) -> None:
+        # Set by TokenResource.__init__, tokens come from sites_manager
+        pass
 
     def preprocess_header(self, header: str) -> str:
         return header.split(" ")[-1]
 
-    def processToken(self, token_data: "SiteManager", request: Request) -> int:
+    def processToken(
+        self, token_data: Union["SiteManager", "SitesManager"], request: Request
+    ) -> Union[int, defer.Deferred[int]]:
         """
         Pass Alerts along if Authorization Header matched.
 
+        Both a list of alerts and Alertmanager's webhook payload, which has
+        the alerts in its "alerts" member, are accepted.
+
         @param token_data: The object associated with the passed token.
+            Global tokens are associated with the L{adlermanager.SitesManager}.
         @type  L{adlermanager.SiteManager}
 
         @param request: The request object associated to this request.
         @type  L{twisted.web.http.Request}
         """
+        # See BoundedRequest
+        if getattr(request, "body_too_large", False):
+            REJECTED.inc(labels=("too_large",))
+            return REQUEST_ENTITY_TOO_LARGE
+        request_body: bytes = request.content.read()  # type: ignore
+        if len(request_body) > self.max_body_size:
+            REJECTED.inc(labels=("too_large",))
+            return REQUEST_ENTITY_TOO_LARGE
 
-        try:
-            request_body: bytes = request.content.read()  # type: ignore
-            alert_data: List[Dict[str, Any]] = json.loads(request_body)
-        except Exception:
-            return BAD_REQUEST
+        started = time.monotonic()
+        decoder = "inline"
+        if len(request_body) > self.cooperative_decode_size:
+            decoder = "cooperative"
+            d = decode_json_cooperatively(request_body)
+        else:
+            d = defer.maybeDeferred(json.loads, request_body)
+
+        def decoded(data: Union[List[Dict[str, Any]], Dict[str, Any]]) -> int:
+            PARSE_SECONDS.observe(time.monotonic() - started, labels=(decoder,))
+            alert_data = data.get("alerts") if isinstance(data, dict) else data
+            if not isinstance(alert_data, list) or not all(
+                Alert.is_valid(ra) for ra in alert_data
+            ):
+                REJECTED.inc(labels=("invalid",))
+                return BAD_REQUEST
+            digest = hashlib.blake2b(request_body, digest_size=16).digest()
+            token_data.enqueue_alerts(alert_data, digest)
+            return OK
 
-        site = token_data
+        def failed(_: Any) -> int:
+            REJECTED.inc(labels=("invalid",))
+            return BAD_REQUEST
 
-        task.deferLater(reactor, 0, site.process_alerts, alert_data)  # type: ignore
-        return OK
+        return d.addCallbacks(decoded, failed)
@@ -1,5 +1,6 @@
 import os
 from datetime import timedelta
+from typing import List
 
 import attr
 
@@ -19,6 +20,66 @@ class ConfigClass(object):
     @type  data_dir: C{unicode}
     """
 
+    cache_dir: str = attr.ib(default=os.getenv("CACHE_DIR", ""))
+    """
+    @param cache_dir: Environment: CACHE_DIR.
+           Directory to keep on-disk caches in, e.g. compiled templates.
+           These are only an optimisation and can be removed at any time.
+           If this is empty, nothing is cached to disk.
+    @type  cache_dir: C{unicode}
+    """
+
+    lazy_sites: bool = attr.ib(default=os.getenv("LAZY_SITES", "") != "")
+    """
+    @param lazy_sites: Environment: LAZY_SITES.
+           If this environment variable is anything other than empty, only
+           what is needed to find a site (its name, tokens and SSH users) is
+           read on startup.
+           Sites are fully loaded when they receive alerts or are visited.
+           This speeds up starting with many sites, particularly with
+           CACHE_DIR, where the index of sites is kept between restarts.
+    @type  lazy_sites: C{unicode}
+    """
+
+    lazy_sites_max_loaded: int = attr.ib(
+        default=int(os.getenv("LAZY_SITES_MAX_LOADED", "0"))
+    )
+    """
+    @param lazy_sites_max_loaded: Environment: LAZY_SITES_MAX_LOADED.
+           With LAZY_SITES, keep at most this many sites fully loaded.
+           Least recently used sites without ongoing incidents are unloaded
+           first, so this may be exceeded.
+           If this is 0, sites are never unloaded.
+    @type  lazy_sites_max_loaded: C{int}
+    """
+
+    watch_sites: bool = attr.ib(default=os.getenv("WATCH_SITES", "YES") != "")
+    """
+    @param watch_sites: Environment: WATCH_SITES.
+           If this environment variable is anything other than empty,
+           changes to sites in DATA_DIR are applied without restarting.
+           This uses inotify on Linux and periodically checks for changes
+           elsewhere.
+    @type  watch_sites: C{unicode}
+    """
+
+    watch_debounce_ms: int = attr.ib(default=int(os.getenv("WATCH_DEBOUNCE_MS", "500")))
+    """
+    @param watch_debounce_ms: Environment: WATCH_DEBOUNCE_MS.
+           Changes are applied once no more changes happened for this many
+           milliseconds, so sites are not read while they are being edited.
+    @type  watch_debounce_ms: C{int}
+    """
+
+    watch_poll_seconds: int = attr.ib(
+        default=int(os.getenv("WATCH_POLL_SECONDS", "30"))
+    )
+    """
+    @param watch_poll_seconds: Environment: WATCH_POLL_SECONDS.
+           Without inotify, sites are checked for changes this often.
+    @type  watch_poll_seconds: C{int}
+    """
+
     # Web
     web_endpoint: str = attr.ib(
         default=os.getenv("WEB_ENDPOINT", r"tcp6:interface=\:\::port=8080")
@@ -42,6 +103,64 @@ class ConfigClass(object):
     @type  web_static_dir: C{unicode}
     """
 
+    web_metrics: bool = attr.ib(default=os.getenv("WEB_METRICS", "") != "")
+    """
+    @param web_metrics: Environment: WEB_METRICS.
+           If this environment variable is anything other than empty,
+           AdlerManager's own metrics are served at /metrics in the
+           Prometheus text format, for any site's host name.
+           Some metrics are labelled with the names of sites, so anyone
+           who can reach a status page can list all sites: only enable
+           this if WEB_ENDPOINT is not public, or /metrics is filtered by
+           a reverse proxy.
+    @type  web_metrics: C{unicode}
+    """
+
+    web_gzip: bool = attr.ib(default=os.getenv("WEB_GZIP", "YES") != "")
+    """
+    @param web_gzip: Environment: WEB_GZIP.
+           If this environment variable is anything other than empty,
+           /api/v1/status responses are gzip-compressed for clients that
+           accept it.
+           Compressed responses are cached as well, see RENDER_CACHE_MB.
+    @type  web_gzip: C{unicode}
+    """
+
+    persistence_threads: int = attr.ib(
+        default=int(os.getenv("PERSISTENCE_THREADS", "2"))
+    )
+    """
+    @param persistence_threads: Environment: PERSISTENCE_THREADS.
+           Files are written in the background, so slow storage does not
+           block serving pages or receiving alerts.
+           This is how many files can be written at the same time.
+           If this is 0, files are written synchronously instead.
+    @type  persistence_threads: C{int}
+    """
+
+    state_snapshot_seconds: int = attr.ib(
+        default=int(os.getenv("STATE_SNAPSHOT_SECONDS", "60"))
+    )
+    """
+    @param state_snapshot_seconds: Environment: STATE_SNAPSHOT_SECONDS.
+           Active incidents, alerts and their deadlines only live in memory.
+           They are saved to DATA_DIR/state.snapshot every this many seconds
+           and when shutting down, and restored on startup, so restarting
+           does not reset sites to OK.
+           If this is 0, state is only saved when shutting down.
+    @type  state_snapshot_seconds: C{int}
+    """
+
+    render_cache_mb: int = attr.ib(default=int(os.getenv("RENDER_CACHE_MB", "64")))
+    """
+    @param render_cache_mb: Environment: RENDER_CACHE_MB.
+           Status pages are only rendered when the state of a site changes.
+           This is how much memory, in megabytes, can be used to keep
+           rendered pages around for all sites.
+           Least recently requested pages are dropped first.
+    @type  render_cache_mb: C{int}
+    """
+
     # SSH
     ssh_enabled: bool = attr.ib(default=os.getenv("SSH_ENABLED", "YES") != "")
     """
@@ -80,7 +199,87 @@ class ConfigClass(object):
     @type  ssh_keys_dir: C{unicode}
     """
 
+    ssh_admin_users: List[str] = attr.ib(
+        default=os.getenv("SSH_ADMIN_USERS", "").split()
+    )
+    """
+    @param ssh_admin_users: Environment: SSH_ADMIN_USERS.
+           Space separated SSH users that can run administrative commands,
+           e.g. to profile AdlerManager.
+    @type  ssh_admin_users: C{unicode}
+    """
+
+    # Profiling
+    profiling: bool = attr.ib(default=os.getenv("PROFILING", "") != "")
+    """
+    @param profiling: Environment: PROFILING.
+           If this environment variable is anything other than empty,
+           SSH_ADMIN_USERS can profile AdlerManager while it runs with the
+           profile_start, profile_stop and profile_dump SSH commands.
+           Otherwise, profiling hooks are not installed at all.
+    @type  profiling: C{unicode}
+    """
+
+    profile_max_seconds: int = attr.ib(
+        default=int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    )
+    """
+    @param profile_max_seconds: Environment: PROFILE_MAX_SECONDS.
+           Profiling stops by itself after at most this many seconds.
+    @type  profile_max_seconds: C{int}
+    """
+
+    profile_sample_ms: int = attr.ib(default=int(os.getenv("PROFILE_SAMPLE_MS", "5")))
+    """
+    @param profile_sample_ms: Environment: PROFILE_SAMPLE_MS.
+           The sampling profiler records what the reactor thread is doing
+           every this many milliseconds.
+    @type  profile_sample_ms: C{int}
+    """
+
     # Alerts processing
+    duplicate_payload_seconds: int = attr.ib(
+        default=int(os.getenv("DUPLICATE_PAYLOAD_SECONDS", "10"))
+    )
+    """
+    @param duplicate_payload_seconds: Environment: DUPLICATE_PAYLOAD_SECONDS.
+           When several AlertManager instances send us the same alerts, we
+           only process them once.
+           Identical payloads for a site are ignored for this many seconds.
+    @type  duplicate_payload_seconds: C{int}
+    """
+
+    ingest_window_ms: int = attr.ib(default=int(os.getenv("INGEST_WINDOW_MS", "500")))
+    """
+    @param ingest_window_ms: Environment: INGEST_WINDOW_MS.
+           Alerts sent to a site within this many milliseconds of each other
+           are merged and processed together.
+           This helps with highly available AlertManager setups, where every
+           instance sends us the same alerts.
+    @type  ingest_window_ms: C{int}
+    """
+
+    webhook_max_body_mb: int = attr.ib(
+        default=int(os.getenv("WEBHOOK_MAX_BODY_MB", "16"))
+    )
+    """
+    @param webhook_max_body_mb: Environment: WEBHOOK_MAX_BODY_MB.
+           Alerts sent to us with bigger bodies, in megabytes, are rejected
+           with a 413 status code without keeping the whole body in memory.
+    @type  webhook_max_body_mb: C{int}
+    """
+
+    webhook_cooperative_decode_kb: int = attr.ib(
+        default=int(os.getenv("WEBHOOK_COOPERATIVE_DECODE_KB", "256"))
+    )
+    """
+    @param webhook_cooperative_decode_kb: Environment: WEBHOOK_COOPERATIVE_DECODE_KB.
+           Alerts sent to us with bigger bodies, in kilobytes, are decoded
+           a few alerts at a time, so other requests are still served
+           while decoding.
+    @type  webhook_cooperative_decode_kb: C{int}
+    """
+
     alert_resolve_minutes: timedelta = attr.ib(
         default=timedelta(minutes=int(os.getenv("ALERT_RESOLVE_MINUTES", "5")))
     )
@@ -145,6 +344,59 @@ class ConfigClass(object):
            Default value: 2 (minutes)
     """
 
+    past_incidents_limit: int = attr.ib(
+        default=int(os.getenv("PAST_INCIDENTS_LIMIT", "5"))
+    )
+    """
+    @param past_incidents_limit: Environment: PAST_INCIDENTS_LIMIT.
+           How many past incidents are shown for each service on status
+           pages, older ones are available in pages of this size at
+           /api/v1/incidents/SERVICE?before=START.
+    @type  past_incidents_limit: C{int}
+    """
+
+    # Incident journal
+    journal_segment_kb: int = attr.ib(
+        default=int(os.getenv("JOURNAL_SEGMENT_KB", "1024"))
+    )
+    """
+    @param journal_segment_kb: Environment: JOURNAL_SEGMENT_KB.
+           Incident events for each service are appended to journal files.
+           A new file is started when the current one is this big, in
+           kilobytes.
+    @type  journal_segment_kb: C{int}
+    """
+
+    journal_segment_hours: int = attr.ib(
+        default=int(os.getenv("JOURNAL_SEGMENT_HOURS", "24"))
+    )
+    """
+    @param journal_segment_hours: Environment: JOURNAL_SEGMENT_HOURS.
+           A new journal file is started when the current one is this old,
+           in hours.
+    @type  journal_segment_hours: C{int}
+    """
+
+    journal_retention_days: int = attr.ib(
+        default=int(os.getenv("JOURNAL_RETENTION_DAYS", "365"))
+    )
+    """
+    @param journal_retention_days: Environment: JOURNAL_RETENTION_DAYS.
+           Journal files that were last written to this many days ago are
+           removed.
+           If this is 0, incident events are kept forever.
+    @type  journal_retention_days: C{int}
+    """
+
+    journal_fsync: bool = attr.ib(default=os.getenv("JOURNAL_FSYNC", "YES") != "")
+    """
+    @param journal_fsync: Environment: JOURNAL_FSYNC.
+           If this environment variable is anything other than empty,
+           incident events are synced to disk as they are written.
+           Events written at the same time are synced together.
+    @type  journal_fsync: C{unicode}
+    """
+
 
 Config = ConfigClass()
 
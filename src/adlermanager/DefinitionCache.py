@@ -0,0 +1,102 @@
+import hashlib
+import pickle  # nosec: B403, we only read files we wrote ourselves
+from typing import Any, Dict, List, Optional, cast
+
+import attr
+from twisted.logger import Logger
+from twisted.python.filepath import FilePath
+
+from .metrics import Counter
+from .Persistence import Persistence
+from .utils import FileSignature, load_yaml
+
+log = Logger()
+
+# Bump when the cached format or normalize_definition change
+CACHE_VERSION = 1
+
+CACHE_HITS = Counter(
+    "adlermanager_definition_cache_hits_total",
+    "Site definitions loaded without parsing YAML",
+)
+CACHE_MISSES = Counter(
+    "adlermanager_definition_cache_misses_total",
+    "Site definitions that had to be parsed",
+)
+
+
+def normalize_definition(definition: Any) -> Dict[str, Any]:
+    """
+    Validate a parsed site.yml and fill in optional lists.
+
+    @raises ValueError: If the definition can't be used.
+    """
+    if not isinstance(definition, dict) or "title" not in definition:
+        raise ValueError("site.yml must be a mapping with a title")
+    # Empty keys in YAML are None
+    definition["ssh_users"] = definition.get("ssh_users") or []
+    definition["services"] = definition.get("services") or []
+    for service in cast(List[Dict[str, Any]], definition["services"]):
+        if not isinstance(service, dict) or "label" not in service:
+            raise ValueError("services in site.yml must be mappings with a label")
+        service["components"] = service.get("components") or []
+    return definition
+
+
+def read_definition(path: FilePath) -> Dict[str, Any]:
+    """
+    Parse and normalize a site.yml.
+    """
+    with path.open("r") as f:
+        return normalize_definition(load_yaml(f))
+
+
+@attr.s
+class DefinitionCache(object):
+    """
+    Parsed site definitions, pickled in a directory.
+
+    Entries are keyed by the path of the site.yml and only used while its
+    L{FileSignature} is unchanged, so unchanged sites load without parsing
+    YAML at all.
+
+    @ivar directory: Where entries are kept.
+    @ivar persistence: Writes entries in the background.
+    """
+
+    directory: FilePath = attr.ib()
+    persistence: Persistence = attr.ib()
+
+    def _entry(self, path: FilePath) -> FilePath:
+        name = hashlib.blake2b(path.path.encode("utf-8"), digest_size=16).hexdigest()
+        return self.directory.child(f"{name}.pickle")
+
+    def load(
+        self, path: FilePath, signature: Optional[FileSignature]
+    ) -> Dict[str, Any]:
+        """
+        Return the normalized definition in path, see L{read_definition}.
+
+        @param signature: The L{FileSignature} of path.
+        """
+        entry = self._entry(path)
+        key = (CACHE_VERSION, path.path, signature)
+        if signature is not None:
+            try:
+                with entry.open("r") as f:
+                    cached_key, definition = pickle.load(f)  # nosec: B301
+                if cached_key == key:
+                    CACHE_HITS.inc()
+                    return cast(Dict[str, Any], definition)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                log.failure("Ignoring invalid cache entry {entry}", entry=entry.path)
+        CACHE_MISSES.inc()
+        definition = read_definition(path)
+        if signature is not None:
+            # Errors are logged by Persistence
+            _ = self.persistence.write(
+                entry, pickle.dumps((key, definition), pickle.HIGHEST_PROTOCOL)
+            ).addErrback(lambda _: None)
+        return definition
@@ -0,0 +1,235 @@
+import bisect
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import attr
+from twisted.internet import defer
+from twisted.logger import Logger
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+
+from .IncidentManager import FILENAME_TIME_FORMAT, IncidentManager
+from .model import Severity
+from .Persistence import Persistence
+
+log = Logger()
+
+# How past incidents' start and end are shown on status pages
+DISPLAY_TIME_FORMAT = "%Y-%m-%d %H:%M UTC"
+# See utils.current_timestamp
+_END_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+# Between an incident's start and seq in cursors, see PastIncident.cursor
+CURSOR_SEPARATOR = "@"
+
+
+def _display_time(value: str, time_format: str) -> str:
+    try:
+        parsed = datetime.strptime(value, time_format)
+    except ValueError:
+        # e.g. an incident that was renamed
+        return value
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime(DISPLAY_TIME_FORMAT)
+
+
+@attr.s(slots=True, frozen=True)
+class PastIncident(object):
+    """
+    Summary of a closed incident.
+
+    @ivar start: When the incident started, also its name
+        (see L{adlermanager.IncidentManager.FILENAME_TIME_FORMAT}).
+    @ivar end: When the incident was closed.
+    @ivar status: Highest severity during the incident.
+    @ivar components: Labels of the affected components.
+    @ivar summary: What happened, from the alerts' summaries.
+    @ivar seq: Line of the incident in the index, incidents starting in the
+        same minute are told apart by this.
+    """
+
+    start: str = attr.ib()
+    end: str = attr.ib()
+    status: Severity = attr.ib(default=Severity.OK)
+    components: List[str] = attr.ib(factory=list)
+    summary: str = attr.ib(default="")
+    seq: int = attr.ib(default=0)
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        """
+        Incidents are sorted by this, it is unique within an index.
+        """
+        return (self.start, self.seq)
+
+    @property
+    def cursor(self) -> str:
+        """
+        Pass this as before to L{IncidentIndex.page} to get older incidents.
+        """
+        return f"{self.start}{CURSOR_SEPARATOR}{self.seq}"
+
+    @classmethod
+    def from_incident(cls, incident: IncidentManager, end: str) -> "PastIncident":
+        return cls(
+            start=incident.timestamp,
+            end=end,
+            status=incident.peak_status,
+            components=sorted(incident.affected_components),
+            summary="; ".join(incident.summaries),
+        )
+
+    @property
+    def display_start(self) -> str:
+        return _display_time(self.start, FILENAME_TIME_FORMAT)
+
+    @property
+    def display_end(self) -> str:
+        return _display_time(self.end, _END_FORMAT)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "start": self.start,
+            "end": self.end,
+            "status": self.status.name.lower(),
+            "components": self.components,
+            "summary": self.summary,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], seq: int = 0) -> "PastIncident":
+        return cls(
+            start=d["start"],
+            end=d["end"],
+            status=Severity.from_string(d["status"]),
+            components=d["components"],
+            summary=d["summary"],
+            seq=seq,
+        )
+
+
+def _cursor_key(cursor: str) -> Tuple[str, int]:
+    start, separator, seq = cursor.rpartition(CURSOR_SEPARATOR)
+    if not separator or not seq.isdigit():
+        # Just a start, as cursors used to be: before all incidents in it
+        return (cursor, -1)
+    return (start, int(seq))
+
+
+def _read_index(path: FilePath) -> Tuple[List[PastIncident], int, int]:
+    """
+    Read an index file, this blocks.
+
+    @return: The incidents, sorted, the amount of lines and how many of them
+        were invalid.
+    """
+    incidents: List[PastIncident] = []
+    lines = 0
+    invalid = 0
+    if path.exists():
+        with path.open("r") as f:
+            for lines, line in enumerate(f, 1):
+                try:
+                    incidents.append(
+                        PastIncident.from_dict(json.loads(line), seq=lines - 1)
+                    )
+                except Exception:
+                    # e.g. a line cut short by a crash
+                    invalid += 1
+    incidents.sort(key=lambda incident: incident.key)
+    return incidents, lines, invalid
+
+
+@attr.s
+class IncidentIndex(object):
+    """
+    Closed incidents of a service, sorted by start, see L{PastIncident}.
+
+    The index is a file with one JSON line per incident, incidents are
+    appended when they are closed.
+    It is read once, in the background, see L{IncidentIndex.load}.
+
+    @ivar path: The index file.
+    """
+
+    path: FilePath = attr.ib()
+    persistence: Persistence = attr.ib()
+    loaded: bool = attr.ib(default=False)
+    _incidents: List[PastIncident] = attr.ib(factory=list)
+    _keys: List[Tuple[str, int]] = attr.ib(factory=list)
+    """key of each incident in _incidents, for bisecting"""
+    _lines: int = attr.ib(default=0)
+    """Lines in the index file, the seq of the next incident"""
+    _closed_while_loading: Optional[List[PastIncident]] = attr.ib(default=None)
+    """Added once the index is loaded, so they are not read twice"""
+
+    def load(self) -> defer.Deferred[None]:
+        """
+        Read the index file from the persistence pool.
+
+        Until this fires, the index is empty.
+        """
+        if self.loaded or self._closed_while_loading is not None:
+            return defer.succeed(None)
+        self._closed_while_loading = []
+
+        def loaded(result: Tuple[List[PastIncident], int, int]) -> None:
+            incidents, self._lines, invalid = result
+            if invalid:
+                log.warn(
+                    "Skipped {invalid} invalid lines in {path}",
+                    invalid=invalid,
+                    path=self.path.path,
+                )
+            self._incidents = incidents
+            self._keys = [incident.key for incident in incidents]
+
+        def failed(failure: Failure) -> None:
+            log.failure("Could not read {path}", failure=failure, path=self.path.path)
+
+        def done(_: None) -> None:
+            self.loaded = True
+            closed, self._closed_while_loading = self._closed_while_loading, None
+            for incident in closed or []:
+                self.add(incident)
+
+        return (
+            self.persistence.call(_read_index, self.path)
+            .addCallbacks(loaded, failed)
+            .addCallback(done)
+        )
+
+    def __len__(self) -> int:
+        return len(self._incidents)
+
+    def add(self, incident: PastIncident) -> None:
+        """
+        Add a closed incident to the index and persist it.
+        """
+        if self._closed_while_loading is not None:
+            self._closed_while_loading.append(incident)
+            return
+        incident = attr.evolve(incident, seq=self._lines)
+        self._lines += 1
+        position = bisect.bisect_right(self._keys, incident.key)
+        self._incidents.insert(position, incident)
+        self._keys.insert(position, incident.key)
+        line = json.dumps(incident.to_dict(), separators=(",", ":")) + "\n"
+        # Errors are logged by Persistence
+        _ = self.persistence.append(
+            self.path, line.encode("utf-8"), fsync=False
+        ).addErrback(lambda _: None)
+
+    def page(self, limit: int, before: Optional[str] = None) -> List[PastIncident]:
+        """
+        Return up to limit incidents, newest first.
+
+        @param before: Only return incidents older than this, pass the
+            L{PastIncident.cursor} of the last incident of a page to get the
+            next one.
+        """
+        end = len(self._incidents)
+        if before is not None:
+            end = bisect.bisect_left(self._keys, _cursor_key(before))
+        return self._incidents[max(0, end - limit) : end][::-1]
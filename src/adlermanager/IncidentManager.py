@@ -1,31 +1,50 @@
-from typing import Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, cast
 
 import attr
-from twisted.internet import defer, reactor, task
+from twisted.internet import defer
 from twisted.python.filepath import FilePath
 
 from .Config import ConfigClass
-from .model import Alert, Severity
-from .utils import current_timestamp, default_errback, noop_deferred
+from .Journal import Journal
+from .model import Alert, Severity, SeverityCounter
+from .Persistence import Persistence
+from .Scheduler import Scheduler, Timer
+from .utils import current_timestamp, noop, noop_deferred
 
 FILENAME_TIME_FORMAT = "%Y-%m-%d-%H%MZ"
+MAX_SUMMARIES = 3
 
 
 @attr.s
 class IncidentManager(object):
     global_config: ConfigClass = attr.ib()
     path: FilePath = attr.ib()
+    scheduler: Scheduler = attr.ib()
+    persistence: Persistence = attr.ib()
     timestamp: str = attr.ib(default="")
 
     last_alert: str = attr.ib(default="")
     active_alerts: Dict[str, Alert] = attr.ib(factory=dict)
+    """component label -> alert, only change it with L{IncidentManager._set_alert}
+    and L{IncidentManager._remove_alert}"""
+    severities: SeverityCounter = attr.ib(factory=SeverityCounter)
+    """Statuses of active_alerts"""
     expired: defer.Deferred[None] = attr.ib(factory=noop_deferred)
-    _timeout: defer.Deferred[None] = attr.ib(factory=noop_deferred)
+    _timeout: Timer = attr.ib(init=False)
     """Incident timeout"""
-    _alert_timeouts: Dict[str, defer.Deferred[None]] = attr.ib(factory=dict)
+    _alert_timeouts: Dict[str, Timer] = attr.ib(factory=dict)
     """alert_label -> timeout"""
 
     _monitoring_down: bool = attr.ib(default=False)
+    state_changed: Callable[[], None] = attr.ib(default=noop)
+    """Called when the incident changes outside of process_alerts"""
+    journal: Optional[Journal] = attr.ib(default=None)
+    """Where events are recorded, see L{IncidentManager.log_event}"""
+    peak_status: Severity = attr.ib(default=Severity.OK)
+    """Highest severity seen during this incident"""
+    affected_components: Set[str] = attr.ib(factory=set)
+    summaries: List[str] = attr.ib(factory=list)
+    """Distinct alert summaries, up to MAX_SUMMARIES"""
 
     @property
     def incident_grouping_seconds(self) -> float:
@@ -36,8 +55,7 @@ class IncidentManager(object):
         return self.global_config.alert_resolve_minutes.total_seconds()
 
     def __attrs_post_init__(self) -> None:
-        if not self.path.isdir():
-            self.path.createDirectory()
+        self._timeout = self.scheduler.timer(self._expire)
 
         timestamp_file = self.path.child("timestamp")
 
@@ -53,9 +71,11 @@ class IncidentManager(object):
                 self.timestamp = self.path.basename()
 
         if not timestamp_file.isfile():
-            # Persist the timestamp file if necessary
-            timestamp_file.setContent(self.timestamp.encode("utf-8"))
-            timestamp_file.chmod(0o644)
+            # Persist the timestamp file if necessary, this creates self.path
+            # Errors are logged by Persistence
+            _ = self.persistence.write(
+                timestamp_file, self.timestamp.encode("utf-8"), mode=0o644
+            ).addErrback(lambda _: None)
 
     def process_heartbeats(self, heartbeats: Iterable[Alert], timestamp: str) -> None:
         if heartbeats:
@@ -63,28 +83,23 @@ class IncidentManager(object):
             if self._monitoring_down:
                 self._monitoring_down = False
                 # Monitoring is back up, re-activate timeout
-                self._timeout = task.deferLater(
-                    reactor,  # type: ignore
-                    self.incident_grouping_seconds,
-                    self._expire,
-                )
+                self._timeout.reset(self.incident_grouping_seconds)
                 self.log_event("[Meta]MonitoringUp", timestamp)
 
     def process_alerts(self, alerts: Iterable[Alert], timestamp: str) -> None:
         if alerts:
-            self._timeout.cancel()
-            self._timeout = task.deferLater(
-                reactor, self.incident_grouping_seconds, self._expire  # type: ignore
-            ).addErrback(default_errback)
+            self._timeout.reset(self.incident_grouping_seconds)
             self.last_alert = timestamp
 
         new_alerts: Dict[str, Alert] = dict()
 
         for alert in alerts:
             alert_label = alert.labels["component"]
-            if alert_label in self._alert_timeouts:
-                self._alert_timeouts[alert_label].cancel()
-            else:
+            self._record(alert)
+            alert_timeout = self._alert_timeouts.get(alert_label)
+            if alert_timeout is None:
+                alert_timeout = self.scheduler.timer(self._expire_alert, alert_label)
+                self._alert_timeouts[alert_label] = alert_timeout
                 new_alerts[alert_label] = alert
             # Use highest known severity for a given incident
             # We also allow Resolved alert notifications
@@ -92,26 +107,70 @@ class IncidentManager(object):
                 alert.status == Severity.OK
                 or alert.status >= self.active_alerts.get(alert_label, alert).status
             ):
-                self.active_alerts[alert_label] = alert
-            self._alert_timeouts[alert_label] = task.deferLater(
-                reactor,  # type: ignore
-                self.alert_resolve_seconds,
-                self._expire_alert,
-                alert_label,
-            ).addErrback(default_errback)
+                self._set_alert(alert_label, alert)
+            alert_timeout.reset(self.alert_resolve_seconds)
 
         if new_alerts:
             self.log_event("New", timestamp, alerts=list(new_alerts.values()))
 
+    def _set_alert(self, alert_label: str, alert: Alert) -> None:
+        previous = self.active_alerts.get(alert_label)
+        self.active_alerts[alert_label] = alert
+        if previous is None:
+            self.severities.add(alert.status)
+        else:
+            self.severities.replace(previous.status, alert.status)
+
+    def _remove_alert(self, alert_label: str) -> None:
+        self.severities.remove(self.active_alerts.pop(alert_label).status)
+
+    def _record(self, alert: Alert) -> None:
+        # Kept for the summary of past incidents, see IncidentIndex
+        self.peak_status = max(self.peak_status, alert.status)
+        self.affected_components.add(alert.labels["component"])
+        summary = alert.annotations.get("summary") or alert.labels.get("alertname")
+        if (
+            summary
+            and summary not in self.summaries
+            and len(self.summaries) < MAX_SUMMARIES
+        ):
+            self.summaries.append(summary)
+
+    def refresh_alerts(self, alerts: Iterable[Alert], timestamp: str) -> None:
+        """
+        Fast path for alerts that were sent again without changes.
+
+        These must be in active_alerts already, so we only push deadlines back.
+        """
+        if alerts:
+            self._timeout.reset(self.incident_grouping_seconds)
+            self.last_alert = timestamp
+        for alert in alerts:
+            self._alert_timeouts[alert.labels["component"]].reset(
+                self.alert_resolve_seconds
+            )
+
+    def stop(self) -> None:
+        """
+        Cancel all deadlines, this incident won't expire anymore.
+        """
+        self._timeout.cancel()
+        for alert_timeout in self._alert_timeouts.values():
+            alert_timeout.cancel()
+
     def _expire(self) -> None:
         if not self._monitoring_down:
+            for alert_timeout in self._alert_timeouts.values():
+                alert_timeout.cancel()
             self.expired.callback(self)  # type: ignore  # twisted bug
 
     def _expire_alert(self, alert_label: str) -> None:
         self.log_event(
             "Resolved", current_timestamp(), alert=self.active_alerts[alert_label]
         )
-        del self.active_alerts[alert_label]
+        self._remove_alert(alert_label)
+        del self._alert_timeouts[alert_label]
+        self.state_changed()
 
     def monitoring_down(self, timestamp: str) -> None:
         self._monitoring_down = True
@@ -124,36 +183,82 @@ class IncidentManager(object):
         alerts: List[Alert] = [],
         alert: Optional[Alert] = None,
     ) -> None:
-        # TODO: we probably actually want something like this
-        pass
-
-    # def log_event(
-    #     self,
-    #     message: str,
-    #     timestamp: str,
-    #     alerts: List[Alert] = [],
-    #     alert: Optional[Alert] = None,
-    # ):
-    #     if alert is not None:
-    #         alerts.append(alert)
-    #     obj = {"message": message, "timestamp": timestamp}
-    #     if alerts:
-    #         alerts = copy.deepcopy(alerts)
-    #         for a in alerts:
-    #             a.status = a.status.css
-    #         obj["alerts"] = alerts
-    #     # self._logs.append(obj)
-    #     # Persist messages
-    #     with self.path.open("w") as f:
-    #         m = Munch.fromDict({"log": self._logs, "timestamp": timestamp})
-    #         f.write(m.toYAML().encode("utf-8"))
+        """
+        Record something that happened during this incident in the journal.
+        """
+        if self.journal is None:
+            return
+        if alert is not None:
+            alerts = alerts + [alert]
+        event: Dict[str, Any] = {
+            "incident": self.timestamp,
+            "timestamp": timestamp,
+            "message": message,
+        }
+        if alerts:
+            event["alerts"] = [a.export_alert() for a in alerts]
+        # Errors are logged by Persistence
+        _ = self.journal.append(event).addErrback(lambda _: None)
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Return what is needed to restore this incident after a restart.
+
+        Deadlines are stored as seconds remaining, see L{StateSnapshot}.
+        """
+        return {
+            "path": self.path.basename(),
+            "timestamp": self.timestamp,
+            "last_alert": self.last_alert,
+            "monitoring_down": self._monitoring_down,
+            "timeout": self._timeout.remaining,
+            "peak_status": self.peak_status.name.lower(),
+            "components": sorted(self.affected_components),
+            "summaries": self.summaries,
+            "alerts": {
+                label: {
+                    "alert": alert.export_alert(),
+                    "timeout": (
+                        self._alert_timeouts[label].remaining
+                        if label in self._alert_timeouts
+                        else None
+                    ),
+                }
+                for label, alert in self.active_alerts.items()
+            },
+        }
+
+    def restore_state(self, state: Dict[str, Any], elapsed: float) -> None:
+        """
+        Restore the state returned by L{IncidentManager.get_state}.
+
+        @param elapsed: Seconds since the state was saved, deadlines that
+            passed meanwhile fire right away.
+        """
+        self.last_alert = state["last_alert"]
+        self._monitoring_down = state["monitoring_down"]
+        self.peak_status = Severity.from_string(state["peak_status"])
+        self.affected_components = set(state["components"])
+        self.summaries = list(state["summaries"])
+        # Alerts first, so they are resolved before the incident if both expired
+        for label, alert_state in cast(Dict[str, Any], state["alerts"]).items():
+            alert = Alert.import_alert(
+                alert_state["alert"],
+                status=Severity.from_string(alert_state["alert"]["status"]),
+            )
+            self._set_alert(label, alert)
+            alert_timeout = self.scheduler.timer(self._expire_alert, label)
+            self._alert_timeouts[label] = alert_timeout
+            if alert_state["timeout"] is not None:
+                alert_timeout.reset(max(0.0, alert_state["timeout"] - elapsed))
+        if state["timeout"] is not None:
+            self._timeout.reset(max(0.0, state["timeout"] - elapsed))
+
+    @property
+    def status(self) -> Severity:
+        return self.severities.status
 
     def component_status(self, component_label: str) -> Severity:
-        return max(
-            (
-                alert.status
-                for alert in self.active_alerts.values()
-                if alert.labels["component"] == component_label
-            ),
-            default=Severity.OK,
-        )
+        # Alerts are kept by component, see process_alerts
+        alert = self.active_alerts.get(component_label)
+        return Severity.OK if alert is None else alert.status
@@ -0,0 +1,142 @@
+"""
+Append-only journals of incident events.
+
+Each service keeps its events in a journal directory, split in segment files
+with one JSON object per line.
+Segments are named after the time they were started, so sorting their names
+sorts them chronologically, and only the newest one is ever appended to.
+"""
+
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import attr
+from twisted.internet import defer
+from twisted.python.filepath import FilePath
+
+from .metrics import Counter
+from .Persistence import Persistence
+
+SEGMENT_SUFFIX = ".jsonl"
+
+EVENTS = Counter(
+    "adlermanager_journal_events_total",
+    "Incident events written to journals",
+)
+SEGMENTS_REMOVED = Counter(
+    "adlermanager_journal_segments_removed_total",
+    "Journal segments removed because they were older than the retention",
+)
+
+
+def segments(directory: FilePath) -> List[FilePath]:
+    """
+    Return the segments in a journal directory, oldest first.
+
+    This blocks.
+    """
+    if not directory.isdir():
+        return []
+    return sorted(
+        (
+            child
+            for child in directory.children()
+            if child.basename().endswith(SEGMENT_SUFFIX)
+        ),
+        key=lambda child: child.basename(),
+    )
+
+
+def read_events(directory: FilePath) -> Iterator[Dict[str, Any]]:
+    """
+    Yield all events in a journal directory, oldest first.
+
+    This blocks. Lines that can't be decoded, e.g. because they were being
+    written when the process stopped, are skipped.
+    """
+    for segment in segments(directory):
+        with segment.open("r") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def compact(directories: List[FilePath], cutoff: float) -> int:
+    """
+    Remove segments that were last written to before cutoff.
+
+    The newest segment of each journal is always kept, as it may be in use.
+    This blocks.
+
+    @param cutoff: Seconds since epoch.
+    @return: Number of removed segments.
+    """
+    removed = 0
+    for directory in directories:
+        for segment in segments(directory)[:-1]:
+            try:
+                if os.stat(segment.path).st_mtime < cutoff:
+                    segment.remove()
+                    removed += 1
+            except FileNotFoundError:
+                # Symlinked sites share journals
+                continue
+    return removed
+
+
+@attr.s
+class Journal(object):
+    """
+    Append-only log of events, see L{Journal.append}.
+
+    Writing happens off the reactor thread, events appended while a write
+    is running are written, and synced, together (see L{Persistence.append}).
+
+    @ivar directory: Where segments are kept.
+    @ivar segment_max_bytes: Start a new segment once the current one is
+        this big.
+    @ivar segment_max_age: Start a new segment once the current one is this
+        old, in seconds.
+    @ivar fsync: Whether to wait for events to reach the disk.
+    """
+
+    directory: FilePath = attr.ib()
+    persistence: Persistence = attr.ib()
+    segment_max_bytes: int = attr.ib(default=1024 * 1024)
+    segment_max_age: float = attr.ib(default=24 * 60 * 60)
+    fsync: bool = attr.ib(default=True)
+    _segment: Optional[FilePath] = attr.ib(default=None)
+    _segment_started: float = attr.ib(default=0.0)
+    _segment_size: int = attr.ib(default=0)
+
+    def _current_segment(self, size: int) -> FilePath:
+        # Every run starts a new segment, so finding the last one doesn't
+        # block and a line cut short by a crash is never continued
+        now = time.time()
+        if (
+            self._segment is None
+            or self._segment_size + size > self.segment_max_bytes
+            or now - self._segment_started >= self.segment_max_age
+        ):
+            started = max(int(now * 1000), int(self._segment_started * 1000) + 1)
+            self._segment = self.directory.child(f"{started:013d}{SEGMENT_SUFFIX}")
+            self._segment_started = started / 1000
+            self._segment_size = 0
+        return self._segment
+
+    def append(self, event: Dict[str, Any]) -> defer.Deferred[None]:
+        """
+        Add an event to the journal.
+
+        @param event: Anything that can be encoded as JSON.
+        @return: Fires once the event is on disk.
+        """
+        line = (json.dumps(event, separators=(",", ":")) + "\n").encode("utf-8")
+        segment = self._current_segment(len(line))
+        self._segment_size += len(line)
+        EVENTS.inc()
+        return self.persistence.append(segment, line, fsync=self.fsync)
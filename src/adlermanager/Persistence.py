@@ -0,0 +1,245 @@
+import os
+import stat
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import attr
+from twisted.internet import defer, reactor, threads
+from twisted.logger import Logger
+from twisted.python.failure import Failure
+from twisted.python.filepath import FilePath
+from twisted.python.threadpool import ThreadPool
+
+from .metrics import Counter, Gauge, Histogram
+from .utils import ensure_dirs
+
+log = Logger()
+
+T = TypeVar("T")
+
+WRITES = Counter(
+    "adlermanager_persistence_writes_total",
+    "Files written to disk",
+)
+COALESCED_WRITES = Counter(
+    "adlermanager_persistence_coalesced_writes_total",
+    "Writes that were replaced by a newer write to the same file before starting",
+)
+FAILED_WRITES = Counter(
+    "adlermanager_persistence_failed_writes_total",
+    "Writes that raised an error",
+)
+QUEUE_DEPTH = Gauge(
+    "adlermanager_persistence_queue_depth",
+    "Files waiting to be written or being written",
+)
+WRITE_SECONDS = Histogram(
+    "adlermanager_persistence_write_seconds",
+    "Time from a write being started until it is on disk",
+)
+
+
+def atomic_write(path: FilePath, content: bytes, mode: Optional[int] = None) -> None:
+    """
+    Replace path's content with content, readers see either version.
+
+    This blocks, use L{Persistence.write} from the reactor thread.
+
+    @param mode: Permissions for the file, by default existing permissions
+        are kept.
+    """
+    ensure_dirs(path.parent())
+    if mode is None and path.exists():
+        mode = stat.S_IMODE(os.stat(path.path).st_mode)
+    tmp = path.temporarySibling(".tmp")
+    try:
+        fd = os.open(tmp.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        with open(fd, "wb") as f:
+            f.write(content)
+        if mode is not None:
+            tmp.chmod(mode)
+        os.replace(tmp.path, path.path)
+    except BaseException:
+        if tmp.exists():
+            tmp.remove()
+        raise
+
+
+def append_file(path: FilePath, content: bytes, fsync: bool = True) -> None:
+    """
+    Append content to path, creating it and its directories as needed.
+
+    This blocks, use L{Persistence.append} from the reactor thread.
+
+    @param fsync: Whether to wait for content to reach the disk.
+    """
+    ensure_dirs(path.parent())
+    fd = os.open(path.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+    try:
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fd, view) :]
+        if fsync:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@attr.s
+class _Write(object):
+    path: FilePath = attr.ib()
+    content: bytes = attr.ib()
+    mode: Optional[int] = attr.ib()
+    append: bool = attr.ib(default=False)
+    """Whether content is appended instead of replacing the file"""
+    fsync: bool = attr.ib(default=False)
+    waiters: List[defer.Deferred[None]] = attr.ib(factory=list)
+
+    def wait(self) -> defer.Deferred[None]:
+        d: defer.Deferred[None] = defer.Deferred()
+        self.waiters.append(d)
+        return d
+
+
+@attr.s
+class Persistence(object):
+    """
+    Write files from a dedicated thread pool, so the reactor never blocks
+    on storage.
+
+    Writes to the same file are serialised and, while one is running,
+    further writes are coalesced: only the newest content is written next.
+    Appends are coalesced too: everything appended meanwhile is written,
+    and synced, at once.
+
+    @ivar threads: Maximum amount of threads writing at the same time.
+        If this is 0, files are written synchronously instead.
+    """
+
+    threads: int = attr.ib(default=2)
+    _pool: ThreadPool = attr.ib(init=False)
+    _pending: Dict[str, _Write] = attr.ib(factory=dict)
+    """path -> write waiting for its turn"""
+    _running: Dict[str, _Write] = attr.ib(factory=dict)
+    """path -> write being run"""
+    _stopping: Optional[List[defer.Deferred[None]]] = attr.ib(default=None)
+    """Waiting for the queue to be empty to stop, see L{Persistence.stop}"""
+    _stopped: bool = attr.ib(default=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._pool = ThreadPool(
+            minthreads=0, maxthreads=self.threads, name="adlermanager-persistence"
+        )
+        if self.threads:
+            self._pool.start()
+        QUEUE_DEPTH.set_function(lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending) + len(self._running)
+
+    def write(
+        self, path: FilePath, content: bytes, mode: Optional[int] = None
+    ) -> defer.Deferred[None]:
+        """
+        Atomically replace path's content, creating directories as needed.
+
+        @param mode: Permissions for the file, if they should be set.
+        @return: Fires once content, or newer content for path, is on disk.
+        """
+        pending = self._pending.get(path.path)
+        if pending is not None:
+            COALESCED_WRITES.inc()
+            pending.content = content
+            pending.mode = mode
+            pending.append = False
+        else:
+            pending = self._pending[path.path] = _Write(path, content, mode)
+        return self._enqueue(pending)
+
+    def append(
+        self, path: FilePath, content: bytes, fsync: bool = True
+    ) -> defer.Deferred[None]:
+        """
+        Append content to path, creating directories as needed.
+
+        @param fsync: Whether to wait for content to reach the disk.
+        @return: Fires once content is on disk.
+        """
+        pending = self._pending.get(path.path)
+        if pending is not None:
+            COALESCED_WRITES.inc()
+            # If a replacement is pending, content is added to it
+            pending.content += content
+            pending.fsync = pending.fsync or fsync
+        else:
+            pending = self._pending[path.path] = _Write(
+                path, content, None, append=True, fsync=fsync
+            )
+        return self._enqueue(pending)
+
+    def call(self, f: Callable[..., T], *args: Any) -> defer.Deferred[T]:
+        """
+        Run blocking I/O in f(*args) from the thread pool.
+        """
+        if self.threads:
+            return threads.deferToThreadPool(
+                reactor, self._pool, f, *args  # type: ignore
+            )
+        return defer.maybeDeferred(f, *args)
+
+    def _enqueue(self, pending: _Write) -> defer.Deferred[None]:
+        d = pending.wait()
+        if pending.path.path not in self._running:
+            self._start(pending.path.path)
+        return d
+
+    def _start(self, key: str) -> None:
+        write = self._running[key] = self._pending.pop(key)
+        started = time.monotonic()
+
+        def done(failure: Optional[Failure]) -> None:
+            WRITE_SECONDS.observe(time.monotonic() - started)
+            del self._running[key]
+            if failure is None:
+                WRITES.inc()
+            else:
+                FAILED_WRITES.inc()
+                log.failure("Could not write {path}", failure, path=write.path.path)
+            if key in self._pending:
+                self._start(key)
+            elif self._stopping is not None and not self.queue_depth:
+                self._stop()
+            for waiter in write.waiters:
+                if failure is None:
+                    waiter.callback(None)
+                else:
+                    waiter.errback(failure)
+
+        if write.append:
+            d = self.call(append_file, write.path, write.content, write.fsync)
+        else:
+            d = self.call(atomic_write, write.path, write.content, write.mode)
+        _ = d.addCallbacks(lambda _: done(None), done)
+
+    def stop(self) -> defer.Deferred[None]:
+        """
+        Stop the thread pool once all queued writes are done.
+        """
+        if self._stopped:
+            return defer.succeed(None)
+        d: defer.Deferred[None] = defer.Deferred()
+        if self._stopping is None:
+            self._stopping = [d]
+            if not self.queue_depth:
+                self._stop()
+        else:
+            self._stopping.append(d)
+        return d
+
+    def _stop(self) -> None:
+        self._stopped = True
+        if self.threads:
+            self._pool.stop()
+        for d in self._stopping or []:
+            d.callback(None)
@@ -0,0 +1,279 @@
+"""
+Profile AdlerManager while it runs, see L{Profiler}.
+
+Hot paths are wrapped with L{hook}, which records how long they take while
+a profile is running.
+Hooks are only installed with L{ConfigClass.profiling}, otherwise they
+cost nothing at all.
+"""
+
+import cProfile
+import functools
+import io
+import math
+import os
+import pstats
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar, cast
+
+import attr
+from twisted.internet import reactor
+from twisted.internet.interfaces import IDelayedCall, IReactorTime
+from twisted.logger import Logger
+
+from .Config import Config
+
+log = Logger()
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+MODES = ("sample", "cprofile")
+FORMATS = ("collapsed", "pstats")
+# Deepest stack recorded by the sampling profiler
+MAX_DEPTH = 128
+
+
+@attr.s
+class _HookStats(object):
+    calls: int = attr.ib(default=0)
+    total: float = attr.ib(default=0.0)
+    slowest: float = attr.ib(default=0.0)
+
+
+@attr.s
+class Profiler(object):
+    """
+    Profile the reactor thread for a bounded amount of time.
+
+    Modes:
+      - sample: a thread records the reactor thread's stack every
+        sample_interval seconds.
+        This has a low, constant overhead, and results can be dumped as
+        collapsed stacks (e.g. for flamegraph.pl) or as a summary.
+      - cprofile: every call is recorded with L{cProfile}, which is precise
+        but slows everything down noticeably.
+
+    Hooks (see L{hook}) are measured in both modes.
+
+    @ivar max_seconds: Profiles stop by themselves after this long.
+    @ivar sample_interval: Seconds between samples.
+    """
+
+    clock: IReactorTime = attr.ib(default=reactor)
+    max_seconds: float = attr.ib(default=60.0)
+    sample_interval: float = attr.ib(default=0.005)
+    mode: str = attr.ib(default="")
+    """Mode of the current or last profile, empty if there was none"""
+    started: float = attr.ib(default=0.0)
+    stopped: float = attr.ib(default=0.0)
+    _running: bool = attr.ib(default=False)
+    _hooks: Dict[str, _HookStats] = attr.ib(factory=dict)
+    _samples: Dict[str, int] = attr.ib(factory=dict)
+    """Collapsed stack -> times it was seen"""
+    _lock: threading.Lock = attr.ib(factory=threading.Lock)
+    _sampler: Optional[threading.Thread] = attr.ib(default=None)
+    _stop_sampling: threading.Event = attr.ib(factory=threading.Event)
+    _cprofile: Optional[cProfile.Profile] = attr.ib(default=None)
+    _stop_call: Optional[IDelayedCall] = attr.ib(default=None)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self, seconds: float, mode: str = "sample") -> float:
+        """
+        Start profiling, this must be called from the reactor thread.
+
+        Results of the last profile are discarded.
+
+        @param seconds: Stop after this long, at most max_seconds.
+        @return: Seconds the profile will run for.
+        """
+        if self._running:
+            raise ValueError("A profile is already running")
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode}, use one of: {', '.join(MODES)}")
+        if not math.isfinite(seconds):
+            raise ValueError(f"Cannot profile for {seconds} seconds")
+        seconds = min(max(seconds, 0.0), self.max_seconds) or self.max_seconds
+        self.mode = mode
+        self._hooks = {}
+        self._samples = {}
+        self._cprofile = None
+        self.started = time.monotonic()
+        self._running = True
+        if mode == "cprofile":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        else:
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(
+                target=self._sample,
+                args=(threading.get_ident(),),
+                name="adlermanager-profiler",
+                daemon=True,
+            )
+            self._sampler.start()
+        self._stop_call = self.clock.callLater(seconds, self.stop)
+        log.info("Started {mode} profile for {seconds}s", mode=mode, seconds=seconds)
+        return seconds
+
+    def stop(self) -> None:
+        """
+        Stop profiling, results are kept until the next profile starts.
+        """
+        if not self._running:
+            return
+        if self._stop_call is not None and self._stop_call.active():
+            self._stop_call.cancel()
+        self._stop_call = None
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            self._sampler.join()
+            self._sampler = None
+        self._running = False
+        self.stopped = time.monotonic()
+        log.info("Stopped {mode} profile", mode=self.mode)
+
+    def record(self, name: str, seconds: float) -> None:
+        """
+        Record a call to a hook.
+        """
+        stats = self._hooks.get(name)
+        if stats is None:
+            stats = self._hooks[name] = _HookStats()
+        stats.calls += 1
+        stats.total += seconds
+        stats.slowest = max(stats.slowest, seconds)
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stop_sampling.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = ";".join(reversed(list(_frame_names(frame))))
+            del frame
+            with self._lock:
+                self._samples[stack] = self._samples.get(stack, 0) + 1
+
+    def dump(self, output_format: str = "collapsed") -> Iterator[str]:
+        """
+        Yield the results of the current or last profile, line by line.
+
+        @param output_format: collapsed, one line per stack with the amount
+            of samples, or pstats, a summary sorted by cumulative time.
+        """
+        if not self.mode:
+            raise ValueError("There is no profile, use profile_start")
+        if output_format not in FORMATS:
+            raise ValueError(
+                f"Unknown format {output_format}, use one of: {', '.join(FORMATS)}"
+            )
+        if self.mode == "cprofile" and output_format == "collapsed":
+            raise ValueError("cprofile profiles can only be dumped as pstats")
+        elapsed = (time.monotonic() if self._running else self.stopped) - self.started
+        yield (
+            f"# {self.mode} profile, {elapsed:.1f}s"
+            + (", still running" if self._running else "")
+        )
+        for name, stats in sorted(self._hooks.items()):
+            yield (
+                f"# hook {name}: {stats.calls} calls, {stats.total * 1000:.1f}ms total,"
+                f" {stats.slowest * 1000:.1f}ms slowest"
+            )
+        if self.mode == "cprofile":
+            yield from self._dump_cprofile()
+            return
+        with self._lock:
+            samples = dict(self._samples)
+        if output_format == "collapsed":
+            for stack, count in sorted(samples.items()):
+                yield f"{stack} {count}"
+        else:
+            yield from _summary(samples, self.sample_interval)
+
+    def _dump_cprofile(self) -> Iterator[str]:
+        assert self._cprofile is not None
+        if self._running:
+            # Stats can't be read while the profile is enabled
+            self._cprofile.disable()
+        stream = io.StringIO()
+        try:
+            stats = pstats.Stats(self._cprofile, stream=stream)
+            stats.sort_stats("cumulative").print_stats(50)
+        finally:
+            if self._running:
+                self._cprofile.enable()
+        yield from stream.getvalue().splitlines()
+
+
+def _frame_names(frame: Optional[FrameType]) -> Iterator[str]:
+    depth = 0
+    while frame is not None and depth < MAX_DEPTH:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        yield f"{code.co_name} ({filename}:{code.co_firstlineno})"
+        frame = frame.f_back
+        depth += 1
+
+
+def _summary(samples: Dict[str, int], interval: float) -> Iterator[str]:
+    """
+    Yield a pstats-like table of functions from sampled stacks.
+    """
+    own: Dict[str, int] = {}
+    cumulative: Dict[str, int] = {}
+    total = sum(samples.values())
+    if not total:
+        yield "No samples"
+        return
+    for stack, count in samples.items():
+        names = stack.split(";")
+        own[names[-1]] = own.get(names[-1], 0) + count
+        for name in set(names):
+            cumulative[name] = cumulative.get(name, 0) + count
+    yield f"{total} samples, every {interval * 1000:g}ms"
+    yield f"{'cumtime':>9} {'cum%':>6} {'tottime':>9} {'tot%':>6}  function"
+    for name, count in sorted(cumulative.items(), key=lambda i: -i[1])[:50]:
+        own_count = own.get(name, 0)
+        yield (
+            f"{count * interval:>9.3f} {count / total:>6.1%} "
+            f"{own_count * interval:>9.3f} {own_count / total:>6.1%}  {name}"
+        )
+
+
+PROFILER = Profiler(
+    max_seconds=Config.profile_max_seconds,
+    sample_interval=Config.profile_sample_ms / 1000,
+)
+
+
+def hook(name: str) -> Callable[[F], F]:
+    """
+    Measure calls to the decorated function while a profile is running.
+
+    Unless L{ConfigClass.profiling} is set, functions are left untouched.
+    """
+
+    def decorator(f: F) -> F:
+        if not Config.profiling:
+            return f
+
+        @functools.wraps(f)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not PROFILER.running:
+                return f(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                PROFILER.record(name, time.perf_counter() - started)
+
+        return cast(F, wrapper)
+
+    return decorator
@@ -0,0 +1,61 @@
+from typing import Optional
+
+import attr
+from twisted.application import service
+from twisted.internet import reactor, task
+from twisted.internet.interfaces import IReactorTime
+from twisted.logger import Logger
+
+from .metrics import Gauge, Histogram
+
+log = Logger()
+
+REACTOR_LAG_SECONDS = Histogram(
+    "adlermanager_reactor_lag_seconds",
+    "How late the reactor ran a call that was due, i.e. how long it was blocked",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+DELAYED_CALLS = Gauge(
+    "adlermanager_reactor_delayed_calls",
+    "Calls scheduled in the reactor",
+)
+
+
+@attr.s
+class ReactorMonitor(service.Service):
+    """
+    Measure how responsive the reactor is.
+
+    A call is scheduled every interval seconds, the time between when it
+    was due and when it ran is the reactor's lag.
+
+    @ivar interval: Seconds between measurements.
+    """
+
+    clock: IReactorTime = attr.ib(default=reactor)
+    interval: float = attr.ib(default=1.0)
+    _loop: Optional[task.LoopingCall] = attr.ib(default=None)
+    _due: float = attr.ib(default=0.0)
+
+    def startService(self) -> None:
+        service.Service.startService(self)
+        DELAYED_CALLS.set_function(lambda: len(self.clock.getDelayedCalls()))
+        self._due = self.clock.seconds() + self.interval
+        self._loop = task.LoopingCall(self._measure)
+        self._loop.clock = self.clock
+        _ = self._loop.start(self.interval, now=False).addErrback(
+            lambda f: log.failure("Stopped measuring reactor lag", failure=f)
+        )
+
+    def stopService(self) -> None:
+        service.Service.stopService(self)
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self._loop = None
+
+    def _measure(self) -> None:
+        now = self.clock.seconds()
+        REACTOR_LAG_SECONDS.observe(max(0.0, now - self._due))
+        # LoopingCall skips calls it missed, so the next one is due at the
+        # next multiple of interval
+        self._due = now + self.interval - (now - self._due) % self.interval
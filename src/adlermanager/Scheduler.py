@@ -0,0 +1,144 @@
+import heapq
+import itertools
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import attr
+from twisted.internet import reactor, task
+from twisted.internet.interfaces import IReactorTime
+from twisted.logger import Logger
+
+log = Logger()
+
+
+@attr.s(slots=True, eq=False)
+class Timer(object):
+    """
+    A deadline that calls callback(*args) once it is reached.
+
+    Timers are created with L{Scheduler.timer} and start out disarmed.
+
+    @ivar deadline: When the timer will fire (see L{Scheduler.clock}), or
+        None if it is not armed.
+    """
+
+    scheduler: "Scheduler" = attr.ib(repr=False)
+    callback: Callable[..., None] = attr.ib()
+    args: Tuple[Any, ...] = attr.ib(default=())
+    deadline: Optional[float] = attr.ib(default=None)
+    _queued: Optional[float] = attr.ib(default=None)
+    """Deadline of this timer's live entry in the scheduler's heap"""
+
+    @property
+    def active(self) -> bool:
+        return self.deadline is not None
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds until the timer fires, or None if it is not armed.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - self.scheduler.clock.seconds()
+
+    def reset(self, seconds: float) -> None:
+        """
+        (Re-)arm the timer to fire in seconds from now.
+        """
+        self.scheduler._arm(self, self.scheduler.clock.seconds() + seconds)
+
+    def cancel(self) -> None:
+        """
+        Disarm the timer, it is fine to call this on inactive timers.
+        """
+        if self.deadline is not None:
+            self.deadline = None
+            self.scheduler.active -= 1
+
+
+@attr.s
+class Scheduler(object):
+    """
+    Single scheduler for all of AdlerManager's deadlines.
+
+    Alerts keep being re-sent while they are active, which means their
+    deadlines get pushed back very often.
+    Instead of cancelling and creating a L{twisted.internet.base.DelayedCall}
+    every time, timers live in a lazy-deletion heap:
+      - Postponing a timer only updates its deadline.
+      - Outdated heap entries are dropped or re-queued when they come up.
+      - A single L{task.LoopingCall} checks the heap every resolution seconds.
+
+    @ivar clock: Provides the current time and drives the scheduler.
+    @ivar resolution: How often, in seconds, expired timers are checked.
+    @ivar active: Number of armed timers.
+    """
+
+    clock: IReactorTime = attr.ib(default=reactor)
+    resolution: float = attr.ib(default=1.0)
+    active: int = attr.ib(default=0)
+    _heap: List[Tuple[float, int, Timer]] = attr.ib(factory=list, repr=False)
+    _sequence: Iterator[int] = attr.ib(factory=itertools.count)
+    _loop: task.LoopingCall = attr.ib(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._loop = task.LoopingCall(self.tick)
+        self._loop.clock = self.clock
+        _ = self._loop.start(self.resolution, now=False).addErrback(
+            lambda f: log.failure("Scheduler stopped", failure=f)
+        )
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of queued heap entries, including outdated ones.
+        """
+        return len(self._heap)
+
+    def timer(self, callback: Callable[..., None], *args: Any) -> Timer:
+        """
+        Create a disarmed L{Timer} that will call callback(*args).
+        """
+        return Timer(scheduler=self, callback=callback, args=args)
+
+    def _arm(self, timer: Timer, deadline: float) -> None:
+        if timer.deadline is None:
+            self.active += 1
+        timer.deadline = deadline
+        # Deadlines that are pushed back are re-queued lazily in tick
+        if timer._queued is None or deadline < timer._queued:
+            timer._queued = deadline
+            heapq.heappush(self._heap, (deadline, next(self._sequence), timer))
+
+    def tick(self) -> None:
+        """
+        Fire all timers whose deadline has been reached.
+        """
+        now = self.clock.seconds()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            queued, _, timer = heapq.heappop(heap)
+            if timer._queued != queued:
+                # Superseded by an earlier entry for the same timer
+                continue
+            timer._queued = None
+            if timer.deadline is None:
+                # Cancelled
+                continue
+            if timer.deadline > now:
+                # Postponed after being queued
+                timer._queued = timer.deadline
+                heapq.heappush(heap, (timer.deadline, next(self._sequence), timer))
+                continue
+            timer.deadline = None
+            self.active -= 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                log.failure(
+                    "Error in scheduled call to {callback}", callback=timer.callback
+                )
+
+    def stop(self) -> None:
+        if self._loop.running:
+            self._loop.stop()
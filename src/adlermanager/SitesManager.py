@@ -1,25 +1,203 @@
-from typing import Any, Dict, Generator, List, Optional, cast
+import json
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
 
 import attr
-import yaml
+import jinja2
 from twisted.internet import defer, reactor, task
+from twisted.internet.interfaces import IDelayedCall
 from twisted.logger import Logger
 from twisted.python.filepath import FilePath
 
+from . import StateSnapshot
 from .Config import ConfigClass
-from .IncidentManager import IncidentManager
-from .model import Alert, Severity, SiteConfig
-from .utils import TimestampFile, default_errback, noop_deferred
+from .DefinitionCache import DefinitionCache, read_definition
+from .IncidentIndex import IncidentIndex, PastIncident
+from .IncidentManager import FILENAME_TIME_FORMAT, IncidentManager
+from .Journal import SEGMENTS_REMOVED, Journal, compact
+from .metrics import Counter, Gauge, Histogram
+from .model import Alert, Severity, SeverityCounter, SiteConfig
+from .Persistence import Persistence
+from .Profiler import hook
+from .Scheduler import Scheduler, Timer
+from .SnapshotCache import SnapshotCache
+from .Templating import get_bytecode_cache, get_jinja_env
+from .utils import (
+    FileSignature,
+    TimestampFile,
+    current_time,
+    current_timestamp,
+    default_errback,
+    file_signature,
+    noop,
+    read_tokens,
+)
+
+ALERTS_RECEIVED = Counter(
+    "adlermanager_alerts_received_total",
+    "Alerts received for a site",
+    ["site"],
+)
+ALERTS_REFRESHED = Counter(
+    "adlermanager_alerts_refreshed_total",
+    "Alerts received again without changes, these skip most processing",
+    ["site"],
+)
+ALERTS_FILTERED = Counter(
+    "adlermanager_alerts_filtered_total",
+    "Alerts ignored because they are for another site, lack labels or match "
+    "no component",
+    ["site"],
+)
+DUPLICATE_PAYLOADS = Counter(
+    "adlermanager_duplicate_payloads_total",
+    "Payloads ignored because they were just processed",
+    ["site"],
+)
+MANIFEST_VERSION = 1
+JOURNAL_COMPACT_SECONDS = 60 * 60
+# Sites tried per use when too many are loaded, see SitesManager._site_used
+UNLOAD_CANDIDATES = 8
+
+PROCESS_ALERTS_SECONDS = Histogram(
+    "adlermanager_process_alerts_seconds",
+    "Time spent processing a batch of alerts for a site",
+)
+ACTIVE_INCIDENTS = Gauge(
+    "adlermanager_active_incidents",
+    "Services with an open incident",
+)
+ACTIVE_INCIDENTS.set(0)
+SCHEDULER_TIMERS = Gauge(
+    "adlermanager_scheduler_timers",
+    "Armed deadlines, e.g. for alerts to be resolved",
+)
+LOADED_SITES = Gauge(
+    "adlermanager_loaded_sites",
+    "Sites that are fully loaded, the rest only have their index in memory",
+)
+RELOAD_SECONDS = Histogram(
+    "adlermanager_reload_seconds",
+    "Time spent picking up changes to sites on disk",
+)
+INGEST_QUEUE_DEPTH = Gauge(
+    "adlermanager_ingest_queue_depth",
+    "Alerts waiting to be processed",
+    ["site"],
+)
+INGEST_MERGED_ALERTS = Counter(
+    "adlermanager_ingest_merged_alerts_total",
+    "Alerts replaced by a newer copy of the same alert before being processed",
+    ["site"],
+)
+# Labelled with the site's name, these are dropped with the site
+SITE_METRICS = (
+    ALERTS_RECEIVED,
+    ALERTS_REFRESHED,
+    ALERTS_FILTERED,
+    DUPLICATE_PAYLOADS,
+    INGEST_QUEUE_DEPTH,
+    INGEST_MERGED_ALERTS,
+)
+INGEST_PAYLOADS_PER_PASS = Histogram(
+    "adlermanager_ingest_payloads_per_pass",
+    "Payloads merged into a single processing pass",
+    buckets=(1, 2, 3, 4, 6, 8, 16, 32),
+)
+INGEST_DELAY_SECONDS = Histogram(
+    "adlermanager_ingest_delay_seconds",
+    "Time from a payload being received until its alerts are processed",
+)
+
+
+@attr.s
+class ReloadReport(object):
+    """
+    Summary of a L{SitesManager.reload}.
+
+    @ivar examined: Sites checked for changes.
+    @ivar reparsed: Existing sites that were read again.
+    @ivar added: New sites.
+    @ivar removed: Deleted sites.
+    @ivar failed: Sites that could not be read, they keep their last state.
+    @ivar duration: Seconds the reload took.
+    """
+
+    examined: int = attr.ib(default=0)
+    reparsed: int = attr.ib(default=0)
+    added: int = attr.ib(default=0)
+    removed: int = attr.ib(default=0)
+    failed: int = attr.ib(default=0)
+    duration: float = attr.ib(default=0.0)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.reparsed or self.added or self.removed or self.failed)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.examined} examined, {self.reparsed} re-parsed, "
+            f"{self.added} added, {self.removed} removed, {self.failed} failed "
+            f"in {self.duration * 1000:.1f}ms"
+        )
 
 
 @attr.s
 class SitesManager(object):
     global_config: ConfigClass = attr.ib()
     site_managers: Dict[str, "SiteManager"] = attr.ib(factory=dict)
-    tokens: Dict[str, "SiteManager"] = attr.ib(factory=dict)
+    """Replaced, not modified, when reloading"""
+    tokens: Dict[str, Union["SiteManager", "SitesManager"]] = attr.ib(factory=dict)
+    """Site tokens map to their site, global tokens map to us.
+    Replaced, not modified, when reloading"""
+    global_tokens: List[str] = attr.ib(factory=list)
+    _global_tokens_signature: Optional[FileSignature] = attr.ib(default=None)
+    last_reload: Optional["ReloadReport"] = attr.ib(default=None)
+    """What the last L{SitesManager.reload} did"""
+    scheduler: Scheduler = attr.ib(factory=Scheduler)
+    """Deadlines for all sites"""
+    persistence: Persistence = attr.ib(init=False)
+    """Writes files for all sites"""
+    snapshots: SnapshotCache = attr.ib(init=False)
+    """Rendered pages for all sites"""
+    definitions: Optional[DefinitionCache] = attr.ib(init=False)
+    """Parsed site.yml files for all sites, if there is a CACHE_DIR"""
+    _loaded: "OrderedDict[str, SiteManager]" = attr.ib(factory=OrderedDict)
+    """Fully loaded sites with LAZY_SITES, least recently used first"""
+    _manifest: Dict[str, Any] = attr.ib(factory=dict)
+    """Index of sites from the last run, only used on startup"""
+    _compactor: Optional[task.LoopingCall] = attr.ib(default=None)
+    """Removes old journal segments, see L{SitesManager.compact_journals}"""
+    _snapshotter: Optional[task.LoopingCall] = attr.ib(default=None)
+    """Saves in-memory state, see L{SitesManager.save_state}"""
     log: Logger = attr.ib(factory=Logger)
 
     def __attrs_post_init__(self) -> None:
+        self.persistence = Persistence(threads=self.global_config.persistence_threads)
+        self.snapshots = SnapshotCache(
+            max_bytes=self.global_config.render_cache_mb * 1024 * 1024
+        )
+        self.definitions = None
+        if self.global_config.cache_dir:
+            self.definitions = DefinitionCache(
+                directory=FilePath(self.global_config.cache_dir).child("definitions"),
+                persistence=self.persistence,
+            )
+
         def startup_message() -> None:
             self.log.info(
                 f"Starting server with this configuration:\n{self.global_config}",
@@ -30,36 +208,365 @@ class SitesManager(object):
         _ = task.deferLater(reactor, 0, startup_message).addErrback(  # type: ignore
             default_errback
         )
+        # Persist in-memory state when shutting down
+        reactor.addSystemEventTrigger("before", "shutdown", self.stop)  # type: ignore
+        if self.global_config.journal_retention_days:
+            self._compactor = task.LoopingCall(self.compact_journals)
+            self._compactor.clock = self.scheduler.clock
+            _ = self._compactor.start(JOURNAL_COMPACT_SECONDS).addErrback(
+                lambda f: self.log.failure("Stopped compacting journals", failure=f)
+            )
         # Load data
+        LOADED_SITES.set_function(lambda: len(self._loaded))
+        SCHEDULER_TIMERS.set_function(lambda: self.scheduler.active)
+        if self.global_config.lazy_sites:
+            self._manifest = self._read_manifest()
         self.reload()
+        self._manifest = {}
+        self.restore_state()
+        if self.global_config.state_snapshot_seconds:
+            self._snapshotter = task.LoopingCall(self.save_state)
+            self._snapshotter.clock = self.scheduler.clock
+            _ = self._snapshotter.start(
+                self.global_config.state_snapshot_seconds, now=False
+            ).addErrback(lambda f: self.log.failure("Stopped saving state", failure=f))
 
     def reload(self) -> "SitesManager":
-        # Read sites
-        read_sites = {
-            site: self.site_managers[site].reload()
-            if site in self.site_managers
-            else SiteManager(
-                global_config=self.global_config, path=self.sites_dir.child(site)
+        """
+        Pick up changes on disk, only files that changed are read again.
+
+        See L{SiteManager.refresh} and L{SitesManager.last_reload}.
+        """
+        self.reload_sites(
+            set(self.load_sites()).union(self.site_managers), global_tokens=True
+        )
+        return self
+
+    @hook("reload")
+    def reload_sites(
+        self, sites: Iterable[str], global_tokens: bool = False
+    ) -> "ReloadReport":
+        """
+        Pick up changes on disk for some sites only.
+
+        New state is built on the side and swapped in at once, so requests
+        never see a half-built L{SitesManager.tokens} or
+        L{SitesManager.site_managers}.
+
+        @param sites: Names of sites that may have been added, changed or
+            deleted.
+        @param global_tokens: Whether to check the global tokens file too.
+        """
+        started = time.monotonic()
+        report = ReloadReport()
+        site_managers = dict(self.site_managers)
+        tokens = dict(self.tokens)
+        for site in sites:
+            exists = self.sites_dir.child(site).isdir()
+            manager = site_managers.get(site)
+            if manager is None and not exists:
+                continue
+            report.examined += 1
+            try:
+                if manager is None:
+                    manager = site_managers[site] = self._new_site(site)
+                    self._update_tokens(
+                        tokens, site_managers, manager, [], manager.tokens
+                    )
+                    report.added += 1
+                elif not exists:
+                    del site_managers[site]
+                    self._loaded.pop(site, None)
+                    manager.stop()
+                    # Kinds of snapshots, see WebRoot
+                    for kind in ("html", "json", "json.gz"):
+                        self.snapshots.discard((kind, site))
+                    self._update_tokens(
+                        tokens, site_managers, manager, manager.tokens, []
+                    )
+                    report.removed += 1
+                else:
+                    old_tokens = manager.tokens
+                    if manager.refresh():
+                        self._update_tokens(
+                            tokens, site_managers, manager, old_tokens, manager.tokens
+                        )
+                        report.reparsed += 1
+            except Exception:
+                # Keep the last good state of the site
+                report.failed += 1
+                self.log.failure(
+                    "Could not reload site {site}",
+                    site=site,
+                    system=SitesManager.__name__,
+                )
+        # Global tokens
+        if global_tokens:
+            signature = file_signature(self.global_tokens_file)
+            if signature != self._global_tokens_signature:
+                self._global_tokens_signature = signature
+                self.global_tokens = read_tokens(self.global_tokens_file)
+                tokens = self._build_tokens(site_managers)
+        # Swap in the new state
+        self.site_managers = site_managers
+        self.tokens = tokens
+        if self.global_config.lazy_sites and report.changed:
+            self._write_manifest()
+        report.duration = time.monotonic() - started
+        self.last_reload = report
+        RELOAD_SECONDS.observe(report.duration)
+        if report.changed:
+            self.log.info(
+                "Reloaded sites: {report}", report=report, system=SitesManager.__name__
             )
-            for site in self.load_sites()
+        return report
+
+    def _update_tokens(
+        self,
+        tokens: Dict[str, Union["SiteManager", "SitesManager"]],
+        site_managers: Dict[str, "SiteManager"],
+        manager: "SiteManager",
+        old_tokens: List[str],
+        new_tokens: List[str],
+    ) -> None:
+        """
+        Apply a site's token changes to tokens.
+
+        Global tokens take precedence over site tokens.
+        """
+        for token in set(old_tokens).difference(new_tokens):
+            if tokens.get(token) is manager:
+                del tokens[token]
+                # Other sites may be using the same token
+                for other in site_managers.values():
+                    if other is not manager and token in other.tokens:
+                        tokens[token] = other
+                        break
+        for token in new_tokens:
+            if tokens.get(token) is not self:
+                tokens[token] = manager
+
+    def _build_tokens(
+        self, site_managers: Dict[str, "SiteManager"]
+    ) -> Dict[str, Union["SiteManager", "SitesManager"]]:
+        tokens: Dict[str, Union[SiteManager, SitesManager]] = {
+            token: manager
+            for manager in site_managers.values()
+            for token in manager.tokens
         }
-        # Remove deleted sites
-        for deleted_site in set(self.site_managers.keys()).difference(
-            read_sites.keys()
-        ):
-            del self.site_managers[deleted_site]
-        # Apply update / add new sites
-        self.site_managers.update(read_sites)
-        # Re-read all sites
-        self.tokens.clear()
-        self.tokens.update(
-            {
-                token: manager
-                for manager in self.site_managers.values()
-                for token in manager.tokens
-            }
+        tokens.update({token: self for token in self.global_tokens})
+        return tokens
+
+    def _new_site(self, site: str) -> "SiteManager":
+        lazy = self.global_config.lazy_sites
+        manager = SiteManager(
+            global_config=self.global_config,
+            path=self.sites_dir.child(site),
+            scheduler=self.scheduler,
+            persistence=self.persistence,
+            definitions=self.definitions,
+            loaded=not lazy,
+            on_use=self._site_used,
+            # Use the index from the last run if the site didn't change
+            previous_index=self._manifest.get(site) if lazy else None,
         )
-        return self
+        if not lazy:
+            self._loaded[site] = manager
+        return manager
+
+    def _site_used(self, manager: "SiteManager") -> None:
+        """
+        Keep track of the least recently used sites, see L{SiteManager.unload}.
+
+        At most UNLOAD_CANDIDATES sites are tried, sites that can't be
+        unloaded count as used so the next call tries other ones.
+        """
+        if not self.global_config.lazy_sites:
+            return
+        self._loaded[manager.site_name] = manager
+        self._loaded.move_to_end(manager.site_name)
+        limit = self.global_config.lazy_sites_max_loaded
+        if not limit or len(self._loaded) <= limit:
+            return
+        # manager is last, so it is never a candidate
+        for _ in range(min(UNLOAD_CANDIDATES, len(self._loaded) - 1)):
+            if len(self._loaded) <= limit:
+                break
+            site, other = next(iter(self._loaded.items()))
+            if other.unload():
+                del self._loaded[site]
+            else:
+                self._loaded.move_to_end(site)
+
+    @property
+    def manifest_file(self) -> Optional[FilePath]:
+        """
+        Index of sites kept between runs with LAZY_SITES, if there is a CACHE_DIR.
+        """
+        if not self.global_config.cache_dir:
+            return None
+        return FilePath(self.global_config.cache_dir).child("sites.json")
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        manifest_file = self.manifest_file
+        if manifest_file is None or not manifest_file.exists():
+            return {}
+        try:
+            manifest = json.loads(manifest_file.getContent())
+            if manifest.get("version") == MANIFEST_VERSION:
+                return cast(Dict[str, Any], manifest["sites"])
+        except Exception:
+            self.log.failure("Ignoring invalid {path}", path=manifest_file.path)
+        return {}
+
+    def _write_manifest(self) -> None:
+        manifest_file = self.manifest_file
+        if manifest_file is None:
+            return
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "sites": {
+                site: manager.index for site, manager in self.site_managers.items()
+            },
+        }
+        # Errors are logged by Persistence
+        _ = self.persistence.write(
+            manifest_file, json.dumps(manifest).encode("utf-8")
+        ).addErrback(lambda _: None)
+
+    @property
+    def global_tokens_file(self) -> FilePath:
+        """
+        Tokens in this file can send alerts for any site.
+        """
+        return FilePath(self.global_config.data_dir).child("tokens.txt")
+
+    def enqueue_alerts(
+        self, raw_alerts: List[Dict[str, Any]], digest: Optional[bytes] = None
+    ) -> None:
+        """
+        Queue alerts sent with a global token.
+
+        These are passed to each site according to their adlermanager label.
+        See L{SiteManager.enqueue_alerts}.
+        """
+        by_site: Dict[str, List[Dict[str, Any]]] = {}
+        for ra in raw_alerts:
+            site = ra.get("labels", {}).get("adlermanager", "")
+            if site in self.site_managers:
+                by_site.setdefault(site, []).append(ra)
+        for site, site_alerts in by_site.items():
+            self.site_managers[site].enqueue_alerts(site_alerts, digest)
+
+    def flush(self) -> None:
+        """
+        Write pending state of all sites to disk.
+        """
+        for manager in self.site_managers.values():
+            manager.last_updated.flush()
+
+    def compact_journals(self) -> defer.Deferred[None]:
+        """
+        Remove journal segments older than L{ConfigClass.journal_retention_days}.
+        """
+        cutoff = time.time() - self.global_config.journal_retention_days * 24 * 60 * 60
+
+        def compact_all() -> int:
+            directories = self.sites_dir.globChildren("*/*/journal")
+            return compact(directories, cutoff)
+
+        def compacted(removed: int) -> None:
+            SEGMENTS_REMOVED.inc(removed)
+
+        # Errors are logged by the LoopingCall
+        return self.persistence.call(compact_all).addCallback(compacted)
+
+    @property
+    def state_file(self) -> FilePath:
+        """
+        Where in-memory state is kept between runs, see L{StateSnapshot}.
+        """
+        return FilePath(self.global_config.data_dir).child("state.snapshot")
+
+    def save_state(self) -> defer.Deferred[None]:
+        """
+        Save a snapshot of the state that only lives in memory.
+
+        @return: Fires once it is on disk.
+        """
+        started = time.monotonic()
+        states = (manager.get_state() for manager in self.site_managers.values())
+        content = StateSnapshot.encode(state for state in states if state)
+        StateSnapshot.SNAPSHOT_SECONDS.observe(time.monotonic() - started)
+        return self.persistence.write(self.state_file, content, mode=0o600)
+
+    def restore_state(self) -> None:
+        """
+        Restore the last snapshot saved with L{SitesManager.save_state}.
+
+        Deadlines are moved forward by the time that passed since, and
+        whatever expired meanwhile does so right away.
+        """
+        if not self.state_file.exists():
+            return
+        started = time.monotonic()
+        try:
+            saved_at, states = StateSnapshot.decode(self.state_file.getContent())
+        except Exception:
+            self.log.failure(
+                "Ignoring invalid {path}",
+                path=self.state_file.path,
+                system=SitesManager.__name__,
+            )
+            return
+        elapsed = max(0.0, time.time() - saved_at)
+        restored = 0
+        for state in states:
+            manager = self.site_managers.get(state.get("site", ""))
+            if manager is None:
+                # The site was removed
+                continue
+            try:
+                manager.restore_state(state, elapsed)
+                restored += 1
+            except Exception:
+                self.log.failure(
+                    "Could not restore state of site {site}",
+                    site=manager.site_name,
+                    system=SitesManager.__name__,
+                )
+        self.log.info(
+            "Restored state of {restored} sites from {elapsed:.0f}s ago "
+            "in {duration:.1f}ms",
+            restored=restored,
+            elapsed=elapsed,
+            duration=(time.monotonic() - started) * 1000,
+            system=SitesManager.__name__,
+        )
+
+    def stop(self) -> defer.Deferred[None]:
+        """
+        Flush all state, the returned Deferred fires once it is on disk.
+        """
+        for loop in (self._compactor, self._snapshotter):
+            if loop is not None and loop.running:
+                loop.stop()
+        for manager in self.site_managers.values():
+            # Whatever happens, the rest must still be saved
+            try:
+                manager.process_queued_alerts()
+            except Exception:
+                self.log.failure(
+                    "Dropped queued alerts for {site}", site=manager.site_name
+                )
+        try:
+            self.flush()
+        except Exception:
+            self.log.failure("Could not flush sites")
+        _ = defer.maybeDeferred(self.save_state).addErrback(
+            lambda f: self.log.failure("Could not save state", failure=f)
+        )
+        return self.persistence.stop()
 
     @property
     def sites_dir(self) -> FilePath:
@@ -79,7 +586,7 @@ class SitesManager(object):
             return o
         for k, sm in self.site_managers.items():
             if u in sm.ssh_users:
-                o[k] = sm
+                o[k] = sm.ensure_loaded()
         return o
 
 
@@ -87,6 +594,8 @@ class SitesManager(object):
 class SiteManager(object):
     global_config: ConfigClass = attr.ib()
     path: FilePath = attr.ib()
+    scheduler: Scheduler = attr.ib()
+    persistence: Persistence = attr.ib()
     tokens: List[str] = attr.ib(factory=list)
     ssh_users: List[str] = attr.ib(factory=list)
     monitoring_is_down: bool = attr.ib(default=False)
@@ -94,8 +603,47 @@ class SiteManager(object):
     title: str = attr.ib(default="")
     site_config: SiteConfig = attr.ib(factory=SiteConfig)
     service_managers: Dict[str, "ServiceManager"] = attr.ib(factory=dict)
+    _routes: Dict[Tuple[str, str], "ServiceManager"] = attr.ib(factory=dict)
+    """(service label, component label) -> ServiceManager"""
+    state_version: int = attr.ib(default=0)
+    """Increases every time something that is shown to users changes"""
+    state_changed_at: float = attr.ib(factory=time.time)
+    last_modified: Optional[float] = attr.ib(default=None)
+    """state_changed_at, unless the state changed earlier within the same
+    second: HTTP dates can't tell those states apart, see serve_snapshot"""
+    _last_change: float = attr.ib(default=0.0)
+    """When state_changed was last called"""
+    _seen: Dict[str, "_SeenAlert"] = attr.ib(factory=dict)
+    """fingerprint -> last processed version of that alert"""
+    _seen_limit: int = attr.ib(default=1024)
+    """Drop inactive alerts from _seen when it grows past this"""
+    _last_payload: Tuple[bytes, float] = attr.ib(default=(b"", 0.0))
+    """Digest of the last payload and when it was received"""
+    _queued_alerts: Dict[str, Dict[str, Any]] = attr.ib(factory=dict)
+    """fingerprint -> newest raw alert waiting to be processed"""
+    _queued_at: List[float] = attr.ib(factory=list)
+    """When each payload in _queued_alerts was received"""
+    _queue_call: Optional[IDelayedCall] = attr.ib(default=None)
+    _signatures: Dict[str, Optional[FileSignature]] = attr.ib(factory=dict)
+    """File name -> L{FileSignature} of the file when it was last read"""
+    loaded: bool = attr.ib(default=True)
+    """False while only the index is in memory, see L{SiteManager.ensure_loaded}"""
+    on_use: Optional[Callable[["SiteManager"], None]] = attr.ib(default=None)
+    """Called when the site receives alerts or is visited"""
+    definitions: Optional[DefinitionCache] = attr.ib(default=None, repr=False)
+    """Parsed site.yml files, if there is a CACHE_DIR"""
+    previous_index: Optional[Dict[str, Any]] = attr.ib(default=None, repr=False)
+    """A previous L{SiteManager.index}, used on creation if the site didn't
+    change since"""
+    _indexed_at: float = attr.ib(factory=time.time)
+    severities: SeverityCounter = attr.ib(factory=SeverityCounter)
+    """Statuses of service_managers, see L{SiteManager.status}"""
 
-    _timeout: defer.Deferred[None] = attr.ib(factory=noop_deferred)
+    _timeout: Timer = attr.ib(init=False)
+    """Monitoring is considered down when this fires"""
+    last_updated: TimestampFile = attr.ib(init=False)
+    _templates: Optional[jinja2.Environment] = attr.ib(default=None)
+    """Lazily built on first render, reset when the site is reloaded"""
     site_name: str = attr.ib(default="")
 
     @property
@@ -105,63 +653,249 @@ class SiteManager(object):
     log: Logger = attr.ib(factory=Logger)
 
     def __attrs_post_init__(self) -> None:
-        self.reload()
+        self._timeout = self.scheduler.timer(self.monitoring_down)
+        self.last_updated = TimestampFile(
+            self.path.child("last_updated.txt"),
+            persistence=self.persistence,
+            clock=self.scheduler.clock,
+        )
+        self.site_name = self.path.basename()
+        if self.loaded:
+            self.reload()
+        else:
+            self.load_index(self.previous_index)
+        self.previous_index = None
+
+    @property
+    def index(self) -> Dict[str, Any]:
+        """
+        What is needed to find this site without loading it.
+        """
+        return {
+            "signatures": self._signatures,
+            "title": self.title,
+            "tokens": self.tokens,
+            "ssh_users": self.ssh_users,
+        }
+
+    def load_index(self, index: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Read only what is needed to find this site: its tokens and SSH users.
+
+        @param index: A previous L{SiteManager.index}, used instead of reading
+            files if they didn't change since.
+        """
+        signatures = self._file_signatures()
+        if (
+            index is not None
+            and isinstance(index.get("signatures"), dict)
+            and signatures
+            == {
+                name: tuple(signature) if signature else None
+                for name, signature in index["signatures"].items()
+            }
+        ):
+            self._signatures = signatures
+            self.title = index["title"]
+            self.tokens = index["tokens"]
+            self.ssh_users = index["ssh_users"]
+            return
+        self.load_definition(signatures.get("site.yml"))
+        self.title = self.definition["title"]
+        self.definition = {}
+        self.load_tokens()
+        # Only once files were read, so failures are retried on refresh
+        self._signatures = signatures
+
+    def ensure_loaded(self) -> "SiteManager":
+        """
+        Fully load this site if only its index is in memory, see
+        L{ConfigClass.lazy_sites}.
+        """
+        if not self.loaded:
+            self.loaded = True
+            self.reload()
+            # Monitoring may have been down since before the site was loaded
+            last_updated = self.last_updated.get()
+            since = max(
+                self._indexed_at,
+                last_updated.timestamp() if last_updated else 0,
+            )
+            remaining = self.monitoring_down_seconds - (time.time() - since)
+            if remaining > 0:
+                self._timeout.reset(remaining)
+            else:
+                self._timeout.cancel()
+                self.monitoring_down()
+        if self.on_use is not None:
+            self.on_use(self)
+        return self
+
+    def unload(self) -> bool:
+        """
+        Keep only the index of this site in memory, unless something is
+        going on.
+
+        @return: Whether the site was unloaded.
+        """
+        if (
+            not self.loaded
+            or self._queued_at
+            or any(
+                manager.current_incident for manager in self.service_managers.values()
+            )
+        ):
+            return False
+        self.last_updated.flush()
+        self._timeout.cancel()
+        self.loaded = False
+        self.monitoring_is_down = False
+        self.definition = {}
+        self.site_config = SiteConfig()
+        # No service has an incident, this only detaches their severities
+        for manager in self.service_managers.values():
+            manager.stop()
+        self.service_managers = {}
+        self._routes = {}
+        self._seen = {}
+        self._templates = None
+        self.state_changed()
+        return True
+
+    def _file_signatures(self) -> Dict[str, Optional[FileSignature]]:
+        return {
+            name: file_signature(self.path.child(name))
+            for name in ("site.yml", "tokens.txt", self.config_file.basename())
+        }
+
+    def refresh(self) -> bool:
+        """
+        Read files for this site again, if they changed since they were read.
+
+        @return: Whether anything was read again.
+        """
+        signatures = self._file_signatures()
+        changed = {
+            name
+            for name, signature in signatures.items()
+            if signature != self._signatures.get(name)
+        }
+        if not changed:
+            return False
+        if not self.loaded:
+            self.load_index()
+            return True
+        if "site.yml" in changed:
+            self.reload()
+            return True
+        if "tokens.txt" in changed:
+            self.load_tokens()
+        if self.config_file.basename() in changed:
+            self.site_config = self.load_config()
+            self.state_changed()
+        self._signatures = signatures
+        return True
 
     def reload(self) -> "SiteManager":
-        self.load_definition()
+        # Files may change while being read, in that case they are read again
+        signatures = self._file_signatures()
+        self.load_definition(signatures.get("site.yml"))
         self.title = self.definition["title"]
         self.load_tokens()
         self.site_config = self.load_config()
-        self.site_name = self.path.basename()
-        self.last_updated = TimestampFile(self.path.child("last_updated.txt"))
+        # Only once files were read, so failures are retried on refresh
+        self._signatures = signatures
+        # Templates may come from the site directory
+        self._templates = None
         # Read services
         read_services: Dict[str, ServiceManager] = {
-            s["label"]: self.service_managers[s["label"]].reload(s)
-            if s["label"] in self.service_managers
-            else ServiceManager(
-                global_config=self.global_config,
-                path=self.path.child(s["label"]),
-                definition=s,
+            s["label"]: (
+                self.service_managers[s["label"]].reload(s)
+                if s["label"] in self.service_managers
+                else ServiceManager(
+                    global_config=self.global_config,
+                    path=self.path.child(s["label"]),
+                    definition=s,
+                    scheduler=self.scheduler,
+                    persistence=self.persistence,
+                    state_changed=self.state_changed,
+                    severities=SeverityCounter(parent=self.severities),
+                )
             )
             for s in cast(List[Dict[str, Any]], self.definition.get("services", dict()))
         }
-        # Remove deleted servicse
-        for deleted_service in set(self.service_managers.keys()).difference(
-            read_services.keys()
-        ):
-            del self.service_managers[deleted_service]
-        # Apply update / add new sites
-        self.service_managers.update(read_services)
+        # Swap in updated / new services, deleted services are dropped
+        for label, manager in self.service_managers.items():
+            if label not in read_services:
+                manager.stop()
+        self.service_managers = read_services
+        # Index services by the labels of the alerts they handle
+        self._routes = {
+            (manager.label, component): manager
+            for manager in self.service_managers.values()
+            for component in manager.component_labels
+        }
+        # Services may have changed, process alerts fully again
+        self._seen.clear()
 
         # Add/reset monitoring timeout
-        self._timeout.cancel()
-        self._timeout = task.deferLater(
-            reactor, self.monitoring_down_seconds, self.monitoring_down  # type: ignore
-        ).addErrback(default_errback)
+        self._timeout.reset(self.monitoring_down_seconds)
+        self.state_changed()
         return self
 
+    def state_changed(self) -> None:
+        """
+        Mark anything rendered from this site's state as outdated.
+        """
+        now = time.time()
+        self.state_version += 1
+        self.state_changed_at = now
+        self.last_modified = (
+            now if math.ceil(now) != math.ceil(self._last_change) else None
+        )
+        self._last_change = now
+
     def monitoring_down(self) -> None:
         self.monitoring_is_down = True
+        self.state_changed()
         for _, manager in self.service_managers.items():
             manager.monitoring_down(self.last_updated.getStr())
 
-    def load_definition(self) -> None:
-        with self.path.child("site.yml").open("r") as f:
-            self.definition = yaml.safe_load(f)
-            self.ssh_users.clear()
-            self.ssh_users.extend((u for u in self.definition.get("ssh_users", [])))
+    def load_definition(self, signature: Optional[FileSignature] = None) -> None:
+        """
+        @param signature: site.yml's L{FileSignature}, to use the
+            L{DefinitionCache}.
+        """
+        site_yml = self.path.child("site.yml")
+        if self.definitions is not None:
+            self.definition = self.definitions.load(site_yml, signature)
+        else:
+            self.definition = read_definition(site_yml)
+        self.ssh_users.clear()
+        self.ssh_users.extend((u for u in self.definition["ssh_users"]))
 
     def load_tokens(self) -> None:
-        tokens_file = self.path.child("tokens.txt")
-        if tokens_file.exists():
-            with open(tokens_file.path, "r") as f:
-                self.tokens = [line.strip() for line in f]
+        self.tokens = read_tokens(self.path.child("tokens.txt"))
         if not self.tokens:
             self.log.warn(
                 "Site {}: No tokens exist, "
                 "your site will never update".format(self.title)
             )
 
+    @property
+    def template(self) -> jinja2.Template:
+        """
+        The status page template for this site.
+
+        Jinja takes care of re-compiling it if it changes on disk.
+        """
+        if self._templates is None:
+            self._templates = get_jinja_env(
+                self.path.path,
+                bytecode_cache=get_bytecode_cache(self.global_config.cache_dir),
+            )
+        return self._templates.get_template("template.j2")
+
     @property
     def config_file(self) -> FilePath:
         return self.path.child("config.yaml")
@@ -172,43 +906,248 @@ class SiteManager(object):
         except Exception:
             return SiteConfig()
 
-    def process_alerts(self, raw_alerts: List[Dict[str, Any]]) -> None:
-        self.last_updated.now()
+    def set_site_config(self, site_config: SiteConfig) -> defer.Deferred[None]:
+        """
+        Apply and persist a new L{SiteConfig} for this site.
 
-        self.monitoring_is_down = False
+        @return: Fires once the configuration is on disk.
+        """
+        self.site_config = site_config
+        self.state_changed()
+        return self.persistence.write(
+            self.config_file, site_config.to_YAML().encode("utf-8"), mode=0o640
+        )
+
+    def stop(self) -> None:
+        """
+        Stop all activity for this site, e.g. after it was deleted.
+        """
+        if self._queue_call is not None and self._queue_call.active():
+            self._queue_call.cancel()
+        self._queue_call = None
         self._timeout.cancel()
-        self._timeout = task.deferLater(
-            reactor, self.monitoring_down_seconds, self.monitoring_down  # type: ignore
-        ).addErrback(default_errback)
+        for manager in self.service_managers.values():
+            manager.stop()
+        for metric in SITE_METRICS:
+            metric.remove((self.site_name,))
 
-        # Filter alerts for this site
-        alerts: List[Alert] = []
-        for ra in raw_alerts:
+    def enqueue_alerts(
+        self, raw_alerts: List[Dict[str, Any]], digest: Optional[bytes] = None
+    ) -> None:
+        """
+        Queue alerts sent to us, they are processed together with other alerts
+        received within L{ConfigClass.ingest_window_ms}.
+
+        Only the newest copy of each alert is kept.
+
+        @param digest: Identifies the payload, identical payloads are
+            ignored for a few seconds (see L{ConfigClass.duplicate_payload_seconds}).
+        """
+        self.ensure_loaded()
+        clock = self.scheduler.clock
+        received_at = clock.seconds()
+        if digest is not None:
+            last_digest, last_received_at = self._last_payload
             if (
-                ra.get("labels", {}).get("adlermanager", "") == self.site_name
-                and ra.get("labels", {}).get("component", "")
-                and ra.get("labels", {}).get("service", "")
+                digest == last_digest
+                and received_at - last_received_at
+                < self.global_config.duplicate_payload_seconds
             ):
-                alerts.append(Alert.import_alert(ra))
+                DUPLICATE_PAYLOADS.inc(labels=(self.site_name,))
+                return
+            self._last_payload = (digest, received_at)
+
+        queued = self._queued_alerts
+        before = len(queued)
+        for ra in raw_alerts:
+            # Keep the fingerprint so process_alerts doesn't compute it again
+            fingerprint = ra["fingerprint"] = Alert.get_fingerprint(ra)
+            queued[fingerprint] = ra
+        INGEST_MERGED_ALERTS.inc(
+            before + len(raw_alerts) - len(queued), labels=(self.site_name,)
+        )
+        INGEST_QUEUE_DEPTH.set(len(queued), labels=(self.site_name,))
+        self._queued_at.append(received_at)
+        if self._queue_call is None:
+            self._queue_call = clock.callLater(
+                self.global_config.ingest_window_ms / 1000, self.process_queued_alerts
+            )
+
+    def process_queued_alerts(self) -> None:
+        """
+        Process alerts queued by L{SiteManager.enqueue_alerts} right away.
+        """
+        if self._queue_call is not None and self._queue_call.active():
+            self._queue_call.cancel()
+        self._queue_call = None
+        if not self._queued_at:
+            return
+        raw_alerts = list(self._queued_alerts.values())
+        queued_at = self._queued_at
+        self._queued_alerts = {}
+        self._queued_at = []
+        INGEST_QUEUE_DEPTH.set(0, labels=(self.site_name,))
+        self.process_alerts(raw_alerts)
+        INGEST_PAYLOADS_PER_PASS.observe(len(queued_at))
+        now = self.scheduler.clock.seconds()
+        for received_at in queued_at:
+            INGEST_DELAY_SECONDS.observe(now - received_at)
+
+    def _route_alert(
+        self,
+        ra: Dict[str, Any],
+        now: datetime,
+        heartbeats: List[Alert],
+        routed: Dict[str, List[Alert]],
+        refreshed: Dict[str, List[Alert]],
+    ) -> bool:
+        """
+        Add an alert to heartbeats, routed or refreshed, see
+        L{SiteManager.process_alerts}.
+
+        @return: Whether the alert is meant for one of our components.
+        """
+        labels = ra.get("labels", {})
+        if labels.get("adlermanager", "") != self.site_name:
+            return False
+        service = labels.get("service", "")
+        component = labels.get("component", "")
+        if not (service and component):
+            return False
+        if labels.get("heartbeat"):
+            heartbeats.append(Alert.import_alert(ra, now=now))
+            return True
+        fingerprint = Alert.get_fingerprint(ra)
+        seen = self._seen.get(fingerprint)
+        if seen is not None and seen.is_refreshed_by(ra, now):
+            refreshed[seen.manager.label].append(seen.alert)
+            return True
+        manager = self._routes.get((service, component))
+        if manager is not None:
+            alert = Alert.import_alert(ra, fingerprint=fingerprint, now=now)
+            routed[manager.label].append(alert)
+            self._seen[fingerprint] = _SeenAlert(_SeenAlert.key(ra), alert, manager)
+        return True
 
+    @hook("process_alerts")
+    def process_alerts(self, raw_alerts: List[Dict[str, Any]]) -> None:
+        """
+        Process alerts sent to us.
+
+        This is usually called by L{SiteManager.process_queued_alerts}.
+        """
+        started = time.monotonic()
+        self.last_updated.now()
+
+        self.monitoring_is_down = False
+        self._timeout.reset(self.monitoring_down_seconds)
+
+        # Filter alerts for this site and route them to their service
         heartbeats: List[Alert] = []
-        filtered_alerts: List[Alert] = []
-        for a in alerts:
-            (heartbeats if a.labels.get("heartbeat") else filtered_alerts).append(a)
+        routed: Dict[str, List[Alert]] = {label: [] for label in self.service_managers}
+        refreshed: Dict[str, List[Alert]] = {
+            label: [] for label in self.service_managers
+        }
+        now = current_time()
+        received = 0
+        for ra in raw_alerts:
+            # Alerts are handled one by one, so an invalid one does not
+            # cost us the rest of the batch
+            try:
+                received += self._route_alert(ra, now, heartbeats, routed, refreshed)
+            except Exception:
+                self.log.failure("Ignoring invalid alert {alert!r}", alert=ra)
 
+        ALERTS_RECEIVED.inc(received, labels=(self.site_name,))
+        ALERTS_FILTERED.inc(
+            len(raw_alerts)
+            - len(heartbeats)
+            - sum(len(alerts) for alerts in routed.values())
+            - sum(len(alerts) for alerts in refreshed.values()),
+            labels=(self.site_name,),
+        )
+        ALERTS_REFRESHED.inc(
+            sum(len(alerts) for alerts in refreshed.values()), labels=(self.site_name,)
+        )
         timestamp = self.last_updated.getStr()
-        for _, manager in self.service_managers.items():
+        for label, manager in self.service_managers.items():
             manager.process_heartbeats(heartbeats, timestamp)
-            manager.process_alerts(filtered_alerts, timestamp)
+            manager.refresh_alerts(refreshed[label], timestamp)
+            manager.process_alerts(routed[label], timestamp)
+        self.state_changed()
+
+        if len(self._seen) > self._seen_limit:
+            self._seen = {
+                fingerprint: seen
+                for fingerprint, seen in self._seen.items()
+                if seen.is_active
+            }
+            self._seen_limit = max(1024, 2 * len(self._seen))
+        PROCESS_ALERTS_SECONDS.observe(time.monotonic() - started)
+
+    def get_state(self) -> Optional[Dict[str, Any]]:
+        """
+        Return what is needed to restore this site after a restart, or None
+        if there is nothing going on.
+
+        See L{StateSnapshot}.
+        """
+        services: Dict[str, Any] = {}
+        for label, manager in self.service_managers.items():
+            service_state = manager.get_state()
+            if service_state is not None:
+                services[label] = service_state
+        if not services and not self.monitoring_is_down:
+            return None
+        return {
+            "site": self.site_name,
+            "monitoring_is_down": self.monitoring_is_down,
+            "timeout": self._timeout.remaining,
+            "services": services,
+        }
+
+    def restore_state(self, state: Dict[str, Any], elapsed: float) -> None:
+        """
+        Restore the state returned by L{SiteManager.get_state}.
+
+        @param elapsed: Seconds since the state was saved.
+        """
+        self.ensure_loaded()
+        self.monitoring_is_down = state["monitoring_is_down"]
+        if state["timeout"] is None:
+            self._timeout.cancel()
+        else:
+            self._timeout.reset(max(0.0, state["timeout"] - elapsed))
+        for label, service_state in cast(Dict[str, Any], state["services"]).items():
+            manager = self.service_managers.get(label)
+            if manager is not None:
+                manager.restore_state(service_state, elapsed)
+        self.state_changed()
 
     @property
     def status(self) -> Severity:
         if self.monitoring_is_down:
             return Severity.ERROR
-        return max(
-            (service.status for _, service in self.service_managers.items()),
-            default=Severity.OK,
-        )
+        return self.severities.status
+
+    def export_status(self) -> Dict[str, Any]:
+        """
+        What the status page shows, as served by /api/v1/status.
+
+        Only what is covered by L{SiteManager.state_changed} is included, so
+        the result can be cached until the state changes.
+        """
+        return {
+            "site": self.site_name,
+            "title": self.title,
+            "status": self.status.name.lower(),
+            "monitoring_is_down": self.monitoring_is_down,
+            "message": self.site_config.message,
+            "force_state": self.site_config.state_is_forced,
+            "services": [
+                manager.export_status() for manager in self.service_managers.values()
+            ],
+        }
 
 
 @attr.s
@@ -216,11 +1155,32 @@ class ServiceManager(object):
     global_config: ConfigClass = attr.ib()
     path: FilePath = attr.ib()
     definition: Dict[str, Any] = attr.ib()
+    scheduler: Scheduler = attr.ib()
+    persistence: Persistence = attr.ib()
     current_incident: Optional[IncidentManager] = attr.ib(default=None)
     component_labels: List[str] = attr.ib(factory=list)
     label: str = attr.ib(default="")
+    state_changed: Callable[[], None] = attr.ib(default=noop)
+    journal: Journal = attr.ib(init=False)
+    """Events of this service's incidents"""
+    incidents: IncidentIndex = attr.ib(init=False)
+    """Closed incidents"""
+    severities: SeverityCounter = attr.ib(factory=SeverityCounter)
+    """Statuses of the current incident's alerts, counted by the site"""
 
     def __attrs_post_init__(self) -> None:
+        self.journal = Journal(
+            directory=self.path.child("journal"),
+            persistence=self.persistence,
+            segment_max_bytes=self.global_config.journal_segment_kb * 1024,
+            segment_max_age=self.global_config.journal_segment_hours * 60 * 60,
+            fsync=self.global_config.journal_fsync,
+        )
+        self.incidents = IncidentIndex(
+            path=self.path.child("incidents.jsonl"), persistence=self.persistence
+        )
+        # Past incidents are shown once they are read
+        _ = self.incidents.load().addCallback(lambda _: self.state_changed())
         self.reload()
 
     def reload(self, definition: Dict[str, Any] = {}) -> "ServiceManager":
@@ -249,58 +1209,178 @@ class ServiceManager(object):
             self.current_incident.process_heartbeats(heartbeats, timestamp)
 
     def process_alerts(self, alerts: List[Alert], timestamp: str) -> None:
-        # Filter by service-affecting alerts
-        alerts = [
-            alert
-            for alert in alerts
-            if alert.labels.get("service") == self.label
-            and alert.labels.get("component") in self.component_labels
-        ]
+        """
+        Process alerts affecting this service's components.
 
+        Alerts have already been routed to us by L{SiteManager.process_alerts}.
+        """
         if alerts and not self.current_incident:
             # Something is up, open an incident
-            self.current_incident = IncidentManager(
-                global_config=self.global_config,
-                path=self.path,
-            )
-            # Notify when incident is considered resolved
-            _ = self.current_incident.expired.addCallback(self.resolve_incident)
+            self.open_incident(current_time().strftime(FILENAME_TIME_FORMAT))
 
         if self.current_incident:
             self.current_incident.process_alerts(alerts, timestamp)
 
+    def open_incident(self, name: str, timestamp: str = "") -> IncidentManager:
+        ACTIVE_INCIDENTS.inc()
+        self.current_incident = IncidentManager(
+            global_config=self.global_config,
+            path=self.path.child(name),
+            scheduler=self.scheduler,
+            persistence=self.persistence,
+            timestamp=timestamp,
+            state_changed=self.state_changed,
+            journal=self.journal,
+            severities=self.severities,
+        )
+        # Notify when incident is considered resolved
+        _ = self.current_incident.expired.addCallback(self.resolve_incident)
+        return self.current_incident
+
+    def get_state(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the state of the current incident, if there is one.
+        """
+        if self.current_incident is None:
+            return None
+        return self.current_incident.get_state()
+
+    def restore_state(self, state: Dict[str, Any], elapsed: float) -> None:
+        """
+        Restore an incident returned by L{ServiceManager.get_state}.
+        """
+        if self.current_incident is not None:
+            return
+        incident = self.open_incident(state["path"], state["timestamp"])
+        incident.restore_state(state, elapsed)
+
+    def refresh_alerts(self, alerts: List[Alert], timestamp: str) -> None:
+        """
+        Process alerts that are already active and did not change.
+
+        See L{SiteManager.process_alerts}.
+        """
+        if self.current_incident:
+            self.current_incident.refresh_alerts(alerts, timestamp)
+
     def resolve_incident(self, _: Any) -> None:
+        if self.current_incident is not None:
+            ACTIVE_INCIDENTS.dec()
+            self.incidents.add(
+                PastIncident.from_incident(self.current_incident, current_timestamp())
+            )
         self.current_incident = None
+        self.severities.clear()
+        self.state_changed()
+
+    def stop(self) -> None:
+        """
+        Stop all activity for this service, e.g. after it was deleted.
+
+        The current incident is dropped without being resolved.
+        """
+        if self.current_incident is not None:
+            ACTIVE_INCIDENTS.dec()
+            self.current_incident.stop()
+            self.current_incident = None
+        self.severities.detach()
 
     @property
     def status(self) -> Severity:
-        if self.current_incident:
-            return max(
-                (
-                    alert.status
-                    for alert in self.current_incident.active_alerts.values()
-                ),
-                default=Severity.OK,
-            )
-        return Severity.OK
+        return self.severities.status
 
-    # @property
-    # def past_incidents(self):
-    #     past = self.path.children().sort()
-    #     if self.current_incident and self.current_incident.path in past:
-    #         past.remove(self.current_incident.path)
-    #     past.reverse()  # Beautiful sleepless code poetry
-    #     # TODO: get limit from config?
-    #     return past[:5]
+    def export_status(self) -> Dict[str, Any]:
+        """
+        See L{SiteManager.export_status}.
+        """
+        incident = self.current_incident
+        active_alerts = incident.active_alerts if incident else {}
+        return {
+            "label": self.label,
+            "name": self.definition.get("name", self.label),
+            "status": self.status.name.lower(),
+            "incident": incident.timestamp if incident else None,
+            "components": [
+                {
+                    "label": component["definition"]["label"],
+                    "name": component["definition"].get("name", ""),
+                    "status": component["status"].name.lower(),
+                }
+                for component in self.components
+            ],
+            "alerts": [
+                {
+                    "component": label,
+                    "status": alert.status.name.lower(),
+                    "summary": alert.annotations.get("summary") or label,
+                    "description": alert.annotations.get("description", ""),
+                    "since": alert.startsAt.isoformat() if alert.startsAt else None,
+                }
+                for label, alert in active_alerts.items()
+            ],
+        }
+
+    @property
+    def past_incidents(self) -> List[PastIncident]:
+        """
+        The latest closed incidents, newest first.
+        """
+        return self.incidents.page(self.global_config.past_incidents_limit)
 
     @property
     def components(self) -> List[Dict[str, Any]]:
         return [
             {
                 "definition": component,
-                "status": self.current_incident.component_status(component["label"])
-                if self.current_incident
-                else Severity.OK,
+                "status": (
+                    self.current_incident.component_status(component["label"])
+                    if self.current_incident
+                    else Severity.OK
+                ),
             }
             for component in self.definition.get("components", [])
         ]
+
+
+@attr.s(slots=True)
+class _SeenAlert(object):
+    """
+    An alert as last processed by a L{SiteManager}.
+
+    Alertmanager keeps sending active alerts, most of the time these are
+    the same we already know about.
+    """
+
+    raw_key: Tuple[Any, ...] = attr.ib()
+    alert: Alert = attr.ib()
+    manager: ServiceManager = attr.ib()
+
+    @staticmethod
+    def key(raw_alert: Dict[str, Any]) -> Tuple[Any, ...]:
+        """
+        Everything but the labels that can change between deliveries.
+        """
+        return (
+            raw_alert.get("startsAt"),
+            raw_alert.get("endsAt"),
+            raw_alert.get("status"),
+            raw_alert.get("annotations", {}),
+        )
+
+    @property
+    def is_active(self) -> bool:
+        incident = self.manager.current_incident
+        return (
+            incident is not None
+            and incident.active_alerts.get(self.alert.labels["component"]) is self.alert
+        )
+
+    def is_refreshed_by(self, raw_alert: Dict[str, Any], now: datetime) -> bool:
+        """
+        Whether raw_alert is the same as our alert, which is still active.
+        """
+        return (
+            self.raw_key == _SeenAlert.key(raw_alert)
+            and (self.alert.endsAt is None or self.alert.endsAt > now)
+            and self.is_active
+        )
@@ -0,0 +1,174 @@
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set
+
+import attr
+from twisted.application import service
+from twisted.internet import reactor, task
+from twisted.internet.interfaces import IDelayedCall, IReactorTime
+from twisted.logger import Logger
+from twisted.python.filepath import FilePath
+
+if TYPE_CHECKING:
+    from twisted.internet.inotify import INotify
+
+    from .SitesManager import SitesManager
+
+log = Logger()
+
+# Files that SitesManager reads, see SiteManager.refresh
+SITE_FILES = {"site.yml", "tokens.txt", "config.yaml"}
+
+
+@attr.s
+class SitesWatcher(service.Service):
+    """
+    Apply changes to sites on disk while running.
+
+    On Linux, inotify tells us which sites changed and only those are read
+    again (see L{SitesManager.reload_sites}).
+    Elsewhere, all sites are checked for changes every poll_interval seconds.
+
+    @ivar debounce: Seconds without further changes to wait for before
+        applying changes, so sites are not read while being edited.
+    @ivar poll_interval: Seconds between checks without inotify.
+    @ivar use_inotify: Whether to try to use inotify at all.
+    """
+
+    sites_manager: "SitesManager" = attr.ib()
+    clock: IReactorTime = attr.ib(default=reactor)
+    debounce: float = attr.ib(default=0.5)
+    poll_interval: float = attr.ib(default=30.0)
+    use_inotify: bool = attr.ib(default=True)
+    _notifier: Optional["INotify"] = attr.ib(default=None)
+    _poll: Optional[task.LoopingCall] = attr.ib(default=None)
+    _aliases: Dict[str, Set[str]] = attr.ib(factory=dict)
+    """Real path -> names of the sites in it, sites may be symlinks"""
+    _dirty_sites: Set[str] = attr.ib(factory=set)
+    _dirty_global: bool = attr.ib(default=False)
+    _restart: bool = attr.ib(default=False)
+    """Whether inotify has to be set up again"""
+    _call: Optional[IDelayedCall] = attr.ib(default=None)
+
+    @property
+    def sites_dir(self) -> FilePath:
+        return self.sites_manager.sites_dir
+
+    def startService(self) -> None:
+        service.Service.startService(self)
+        if not (self.use_inotify and self._start_inotify()):
+            self._start_polling()
+
+    def stopService(self) -> None:
+        service.Service.stopService(self)
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._stop_inotify()
+        if self._poll is not None and self._poll.running:
+            self._poll.stop()
+        self._poll = None
+
+    def _start_polling(self) -> None:
+        self._poll = task.LoopingCall(self.sites_manager.reload)
+        self._poll.clock = self.clock
+        _ = self._poll.start(self.poll_interval, now=False).addErrback(
+            lambda f: log.failure("Stopped checking sites for changes", failure=f)
+        )
+
+    def _start_inotify(self) -> bool:
+        try:
+            from twisted.internet import inotify
+
+            self._notifier = inotify.INotify()
+            self._notifier.startReading()
+            # Global tokens
+            self._watch(self.sites_manager.global_tokens_file.parent())
+            # Added / removed sites
+            self._watch(self.sites_dir)
+            for site_dir in self.sites_dir.children():
+                if site_dir.isdir():
+                    self._watch_site(site_dir)
+        except Exception:
+            log.failure(
+                "Could not watch sites with inotify, "
+                "checking for changes every {interval}s instead",
+                interval=self.poll_interval,
+            )
+            self._stop_inotify()
+            return False
+        return True
+
+    def _stop_inotify(self) -> None:
+        if self._notifier is not None:
+            self._notifier.loseConnection()
+            self._notifier = None
+        self._aliases.clear()
+
+    def _watch(self, path: FilePath) -> None:
+        from twisted.internet import inotify
+
+        assert self._notifier is not None
+        _ = self._notifier.watch(
+            path,
+            mask=(
+                inotify.IN_CLOSE_WRITE
+                | inotify.IN_CREATE
+                | inotify.IN_DELETE
+                | inotify.IN_MOVED_FROM
+                | inotify.IN_MOVED_TO
+                | inotify.IN_ATTRIB
+            ),
+            callbacks=[self._notified],
+        )
+
+    def _watch_site(self, site_dir: FilePath) -> None:
+        # Symlinked sites share their inotify watch, changes apply to all of them
+        self._aliases.setdefault(site_dir.realpath().path, set()).add(
+            site_dir.basename()
+        )
+        self._watch(site_dir)
+
+    def _notified(self, _: Any, path: FilePath, mask: int) -> None:
+        from twisted.internet import inotify
+
+        if mask & inotify.IN_DELETE_SELF:
+            # INotify stops altogether when a watched directory is removed
+            self._restart = True
+            self._changed(None)
+            return
+        path = path.asTextMode()
+        parent = path.parent()
+        if parent == self.sites_dir:
+            # A site was added, removed or renamed
+            if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO) and path.isdir():
+                self._watch_site(path)
+            self._changed(path.basename())
+        elif parent.parent() == self.sites_dir and path.basename() in SITE_FILES:
+            site = parent.basename()
+            self._changed(site)
+            for alias in self._aliases.get(parent.realpath().path, ()):
+                self._changed(alias)
+        elif path == self.sites_manager.global_tokens_file:
+            self._dirty_global = True
+            self._changed(None)
+
+    def _changed(self, site: Optional[str]) -> None:
+        if site is not None:
+            self._dirty_sites.add(site)
+        if self._call is not None and self._call.active():
+            self._call.reset(self.debounce)
+        else:
+            self._call = self.clock.callLater(self.debounce, self._apply)
+
+    def _apply(self) -> None:
+        self._call = None
+        sites, self._dirty_sites = self._dirty_sites, set()
+        global_tokens, self._dirty_global = self._dirty_global, False
+        if self._restart:
+            # Events may have been lost, check all sites
+            self._restart = False
+            self._stop_inotify()
+            if not self._start_inotify():
+                self._start_polling()
+            _ = self.sites_manager.reload()
+        else:
+            _ = self.sites_manager.reload_sites(sites, global_tokens=global_tokens)
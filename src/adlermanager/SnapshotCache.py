@@ -0,0 +1,89 @@
+import hashlib
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import attr
+
+
+@attr.s(slots=True)
+class Snapshot(object):
+    """
+    A rendered representation of a site's state.
+
+    @ivar version: Opaque value identifying the state that was rendered.
+    @ivar body: The rendered bytes.
+    @ivar etag: Strong entity tag for body, ready to be sent.
+    @ivar last_modified: When the rendered state changed, seconds since epoch,
+        or None if that date also applies to other states, see
+        L{SiteManager.last_modified}.
+    @ivar content_type: Value for the Content-Type header.
+    """
+
+    version: object = attr.ib()
+    body: bytes = attr.ib()
+    etag: bytes = attr.ib()
+    last_modified: Optional[float] = attr.ib()
+    content_type: bytes = attr.ib()
+
+    @classmethod
+    def create(
+        cls,
+        version: object,
+        body: bytes,
+        last_modified: Optional[float],
+        content_type: bytes = b"text/html; charset=utf-8",
+    ) -> "Snapshot":
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        return cls(
+            version=version,
+            body=body,
+            etag=f'"{digest}"'.encode("ascii"),
+            last_modified=last_modified,
+            content_type=content_type,
+        )
+
+
+@attr.s
+class SnapshotCache(object):
+    """
+    Memory-bounded LRU cache of L{Snapshot}s, shared by all sites.
+
+    @ivar max_bytes: Upper bound for the sum of all cached bodies.
+    """
+
+    max_bytes: int = attr.ib()
+    size: int = attr.ib(default=0)
+    _entries: "OrderedDict[Hashable, Snapshot]" = attr.ib(factory=OrderedDict)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: object) -> Optional[Snapshot]:
+        """
+        Return the cached snapshot for key if it still matches version.
+        """
+        snapshot = self._entries.get(key)
+        if snapshot is None or snapshot.version != version:
+            return None
+        self._entries.move_to_end(key)
+        return snapshot
+
+    def put(self, key: Hashable, snapshot: Snapshot) -> None:
+        """
+        Cache snapshot under key, evicting the least recently used entries
+        if we would go over max_bytes.
+        """
+        self.discard(key)
+        if len(snapshot.body) > self.max_bytes:
+            # Caching this would evict everything else and itself
+            return
+        self._entries[key] = snapshot
+        self.size += len(snapshot.body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.body)
+
+    def discard(self, key: Hashable) -> None:
+        snapshot = self._entries.pop(key, None)
+        if snapshot is not None:
+            self.size -= len(snapshot.body)
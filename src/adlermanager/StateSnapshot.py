@@ -0,0 +1,84 @@
+"""
+Snapshots of the state that only lives in memory: active incidents, their
+alerts and deadlines, and whether monitoring is down.
+
+A snapshot starts with L{MAGIC}, followed by records, each one being:
+  - The length of its payload, 4 bytes, big endian.
+  - The CRC32 of its payload, 4 bytes, big endian.
+  - Its payload, a JSON object.
+The first record is a header, each following record is the state of a site
+(see L{SiteManager.get_state}).
+"""
+
+import json
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from twisted.logger import Logger
+
+from .metrics import Histogram
+
+log = Logger()
+
+MAGIC = b"ADLERMANAGER-STATE\n"
+VERSION = 1
+_RECORD_HEADER = struct.Struct(">II")
+
+SNAPSHOT_SECONDS = Histogram(
+    "adlermanager_state_snapshot_seconds",
+    "Time spent collecting and encoding the state of all sites",
+)
+
+
+def _record(payload: Dict[str, Any]) -> bytes:
+    data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return _RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def encode(sites: Iterable[Dict[str, Any]]) -> bytes:
+    """
+    Return a snapshot with the given site states, taken now.
+    """
+    parts = [MAGIC, _record({"version": VERSION, "saved_at": time.time()})]
+    parts.extend(_record(site) for site in sites)
+    return b"".join(parts)
+
+
+def decode(content: bytes) -> Tuple[float, List[Dict[str, Any]]]:
+    """
+    Return when a snapshot was taken and the site states in it.
+
+    Reading stops at the first truncated or corrupted record, so a damaged
+    snapshot still restores the sites before the damage.
+
+    @raises ValueError: If content is not a snapshot we can read.
+    """
+    if not content.startswith(MAGIC):
+        raise ValueError("Not a state snapshot")
+    records: List[Dict[str, Any]] = []
+    view = memoryview(content)
+    offset = len(MAGIC)
+    while offset < len(view):
+        if offset + _RECORD_HEADER.size > len(view):
+            log.warn("State snapshot is truncated")
+            break
+        length, crc = _RECORD_HEADER.unpack_from(view, offset)
+        offset += _RECORD_HEADER.size
+        data = view[offset : offset + length]
+        offset += length
+        if len(data) < length:
+            log.warn("State snapshot is truncated")
+            break
+        if zlib.crc32(data) != crc:
+            log.warn("State snapshot is corrupted")
+            break
+        try:
+            records.append(json.loads(bytes(data)))
+        except ValueError:
+            log.warn("Skipping invalid record in state snapshot")
+    header: Optional[Dict[str, Any]] = records.pop(0) if records else None
+    if header is None or header.get("version") != VERSION:
+        raise ValueError("Unsupported state snapshot")
+    return float(header["saved_at"]), records
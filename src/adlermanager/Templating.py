@@ -0,0 +1,67 @@
+import functools
+from typing import Optional
+
+import jinja2
+import markdown
+from jinja2.utils import markupsafe  # type: ignore
+from twisted.python.filepath import FilePath
+
+from .utils import ensure_dirs
+
+
+def get_jinja_env(
+    supportDir: str, bytecode_cache: Optional[jinja2.BytecodeCache] = None
+) -> jinja2.Environment:
+    """
+    Return a L{jinja2.Environment} with templates loaded from:
+      - Package
+      - Support dir
+
+    @param supportDir: Full path to supportDir.
+      See L{authapiv02.DefaultConfig.Config}
+    @type supportDir: L{str}
+
+    @param bytecode_cache: Optional cache for compiled templates.
+    @type bytecode_cache: L{jinja2.BytecodeCache}
+    """
+    md = markdown.Markdown(
+        extensions=[
+            "markdown.extensions.toc",
+            "markdown.extensions.tables",
+        ]
+    )
+    templates = jinja2.Environment(
+        extensions=["jinja2.ext.do", "jinja2.ext.loopcontrols"],
+        loader=jinja2.ChoiceLoader(
+            [
+                jinja2.FileSystemLoader(supportDir),
+                jinja2.PackageLoader("adlermanager", "templates"),
+            ]
+        ),
+        autoescape=True,
+        # Re-compile templates if they change on disk
+        auto_reload=True,
+        bytecode_cache=bytecode_cache,
+    )
+
+    def md_filter(txt: str) -> markupsafe.Markup:
+        # The Markdown instance is re-used across renders
+        return markupsafe.Markup(md.reset().convert(txt))
+
+    templates.filters["markdown"] = md_filter  # type: ignore
+    return templates
+
+
+@functools.lru_cache()
+def get_bytecode_cache(cache_dir: str) -> Optional[jinja2.BytecodeCache]:
+    """
+    Return the L{jinja2.BytecodeCache} shared by all sites.
+
+    @param cache_dir: See L{adlermanager.Config.ConfigClass.cache_dir}.
+    @return: None if caching to disk is disabled.
+    """
+    if not cache_dir:
+        return None
+    directory = FilePath(cache_dir).child("templates")
+    ensure_dirs(directory)
+    return jinja2.FileSystemBytecodeCache(directory.path)
@@ -52,7 +52,9 @@ class TokenResource(resource.Resource):
     def preprocess_header(self, header: str) -> str:
         return header
 
-    def processToken(self, token_data: Any, request: Request) -> int:
+    def processToken(
+        self, token_data: Any, request: Request
+    ) -> Union[int, defer.Deferred[int]]:
         """
         Process the token and write to request as needed.
 
@@ -78,7 +80,9 @@ class TokenResource(resource.Resource):
         @param request: The request object associated to this request.
         """
         try:
-            res = yield defer.maybeDeferred(self.processToken, token_data, request)
+            res = yield defer.maybeDeferred(  # type: ignore
+                self.processToken, token_data, request
+            )
             code: int = cast(int, res)
         except Exception:
             log.failure("Unknown error")
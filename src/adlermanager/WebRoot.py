@@ -1,62 +1,146 @@
 # pyright: reportUnusedFunction=false
-from typing import cast
+import gzip
+import json
+import math
+import time
+from typing import Optional, Union, cast
 
-import jinja2
-import markdown
-from jinja2.utils import markupsafe  # type: ignore
 from klein import Klein
 from klein.resource import KleinResource
 from twisted.logger import Logger
-from twisted.python.filepath import FilePath
-from twisted.web import resource, static
+from twisted.web import http, resource, server, static
 from twisted.web.server import Request
 
 from .AdlerManagerTokenResource import AdlerManagerTokenResource
 from .Config import Config
+from .metrics import REGISTRY, Histogram
+from .Profiler import hook
 from .SitesManager import SiteManager, SitesManager
+from .SnapshotCache import Snapshot
 
 log = Logger()
 
+REQUEST_SECONDS = Histogram(
+    "adlermanager_http_request_seconds",
+    "Time from a request being received until its response is finished",
+    ["path", "code"],
+)
+RENDER_SECONDS = Histogram(
+    "adlermanager_render_seconds",
+    "Time spent rendering status pages",
+)
+# Requests to other paths are not measured, e.g. to not track every
+# static file
+MEASURED_PATHS = {
+    b"/": "/",
+    b"/api/v1/alerts": "/api/v1/alerts",
+    b"/api/v1/status": "/api/v1/status",
+}
 
-def get_jinja_env(supportDir: str) -> jinja2.Environment:
+
+class BoundedRequest(server.Request):
     """
-    Return a L{jinja2.Environment} with templates loaded from:
-      - Package
-      - Support dir
+    A L{server.Request} that stops buffering bodies bigger than max_body_size.
 
-    @param supportDir: Full path to supportDir.
-      See L{authapiv02.DefaultConfig.Config}
-    @type supportDir: L{str}
+    If body_too_large is set, the body is incomplete and must be rejected.
+    See L{AdlerManagerTokenResource.processToken}.
     """
-    md = markdown.Markdown(
-        extensions=[
-            "markdown.extensions.toc",
-            "markdown.extensions.tables",
-        ]
-    )
-    templates = jinja2.Environment(
-        extensions=["jinja2.ext.do", "jinja2.ext.loopcontrols"],
-        loader=jinja2.ChoiceLoader(
-            [
-                jinja2.FileSystemLoader(supportDir),
-                jinja2.PackageLoader("adlermanager", "templates"),
-            ]
-        ),
-        autoescape=True,
-    )
-
-    def md_filter(txt: str) -> markupsafe.Markup:
-        return markupsafe.Markup(md.convert(txt))
-
-    templates.filters["markdown"] = md_filter  # type: ignore
-    return templates
+
+    max_body_size = Config.webhook_max_body_mb * 1024 * 1024
+    body_too_large = False
+    _received = 0
+    _started = 0.0
+
+    def process(self) -> None:
+        self._started = time.monotonic()
+        server.Request.process(self)
+
+    def finish(self) -> None:
+        measured = MEASURED_PATHS.get(self.path)
+        if measured is not None and self._started:
+            REQUEST_SECONDS.observe(
+                time.monotonic() - self._started, labels=(measured, str(self.code))
+            )
+        server.Request.finish(self)
+
+    def gotLength(self, length: Optional[int]) -> None:
+        if length is not None and length > self.max_body_size:
+            self.body_too_large = True
+            # Do not create a temporary file for a body we will not read
+            length = 0
+        server.Request.gotLength(self, length)
+
+    def handleContentChunk(self, data: bytes) -> None:
+        if self.body_too_large:
+            return
+        self._received += len(data)
+        if self._received > self.max_body_size:
+            self.body_too_large = True
+            self.content.seek(0)  # type: ignore
+            self.content.truncate()  # type: ignore
+            return
+        server.Request.handleContentChunk(self, data)
+
+
+@hook("render")
+def render_page(site: SiteManager) -> bytes:
+    return site.template.render(site=site).encode("utf-8")
+
+
+def serve_snapshot(request: Request, snapshot: Snapshot) -> bytes:
+    """
+    Write a L{Snapshot}'s headers to request and return the body to send.
+
+    Conditional requests matching the snapshot get an empty 304 response.
+    If-None-Match is always checked, If-Modified-Since only when the
+    request has no If-None-Match and the snapshot has a last_modified.
+    """
+    request.setHeader(b"Content-Type", snapshot.content_type)
+    # Clients may keep a copy, but they must ask us whether it is current
+    request.setHeader(b"Cache-Control", b"no-cache")
+    if request.setETag(snapshot.etag) == http.CACHED:  # type: ignore
+        return b""
+    if snapshot.last_modified is None:
+        # A date would match other versions too, clients must use the ETag
+        return snapshot.body
+    if request.getHeader(b"If-None-Match") is None:
+        if request.setLastModified(snapshot.last_modified) == http.CACHED:
+            return b""
+    else:
+        # If-None-Match takes precedence over If-Modified-Since
+        request.lastModified = int(math.ceil(snapshot.last_modified))
+    return snapshot.body
+
+
+def accepts_gzip(request: Request) -> bool:
+    """
+    Whether request's Accept-Encoding allows a gzip-compressed response.
+    """
+    header = request.getHeader(b"Accept-Encoding")
+    if not header:
+        return False
+    for coding in header.split(b","):
+        name, _, params = coding.partition(b";")
+        if name.strip().lower() not in (b"gzip", b"x-gzip", b"*"):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith(b"q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+# Upper bound for ?limit= in /api/v1/incidents
+MAX_INCIDENTS_PAGE = 100
 
 
 def web_root(sites_manager: "SitesManager") -> KleinResource:
     app = Klein()
 
-    @app.route("/")  # type: ignore
-    def index(request: Request):
+    def get_site(request: Request) -> Union[SiteManager, resource.ErrorPage]:
         try:
             host = cast(str, request.getRequestHostname().decode("utf-8"))
         except Exception:
@@ -67,27 +151,126 @@ def web_root(sites_manager: "SitesManager") -> KleinResource:
             return resource.ErrorPage(
                 404, "Gone cat", '<a href="http://http.cat/404">http://http.cat/404</a>'
             )
-        site: SiteManager
         try:
-            site = sites_manager.site_managers[host]
+            return sites_manager.site_managers[host].ensure_loaded()
         except Exception:
             log.failure("sad cat")
             return resource.ErrorPage(
                 500, "Sad cat", '<a href="http://http.cat/500">http://http.cat/500</a>'
             )
 
-        site_path = cast(  # type: ignore
-            str, FilePath(Config.data_dir).child("sites").child(host).path
-        )
-        templates = get_jinja_env(site_path)
-        template = templates.get_template("template.j2")
+    @app.route("/")  # type: ignore
+    def index(request: Request):
+        site = get_site(request)
+        if not isinstance(site, SiteManager):
+            return site
+        host = site.site_name
+
+        template = site.template
+        # Rendered pages are only valid for the same state and template
+        version = (site.state_version, template)
+        snapshot = sites_manager.snapshots.get(("html", host), version)
+        if snapshot is None:
+            started = time.monotonic()
+            body = render_page(site)
+            RENDER_SECONDS.observe(time.monotonic() - started)
+            snapshot = Snapshot.create(
+                version=version,
+                body=body,
+                last_modified=site.last_modified,
+            )
+            sites_manager.snapshots.put(("html", host), snapshot)
+
+        return serve_snapshot(request, snapshot)
+
+    @app.route("/api/v1/status")  # type: ignore
+    def status(request: Request) -> Union[bytes, resource.ErrorPage]:
+        """
+        The state of a site, its services and their components, and the
+        active alerts, see L{SiteManager.export_status}.
+        """
+        site = get_site(request)
+        if not isinstance(site, SiteManager):
+            return site
+        host = site.site_name
+
+        version = site.state_version
+        snapshot = sites_manager.snapshots.get(("json", host), version)
+        if snapshot is None:
+            snapshot = Snapshot.create(
+                version=version,
+                body=json.dumps(site.export_status()).encode("utf-8"),
+                last_modified=site.last_modified,
+                content_type=b"application/json",
+            )
+            sites_manager.snapshots.put(("json", host), snapshot)
+
+        if Config.web_gzip:
+            request.setHeader(b"Vary", b"Accept-Encoding")
+            if accepts_gzip(request):
+                # Compressed bodies get their own ETag
+                compressed = sites_manager.snapshots.get(("json.gz", host), version)
+                if compressed is None:
+                    compressed = Snapshot.create(
+                        version=version,
+                        body=gzip.compress(snapshot.body, mtime=0),
+                        last_modified=snapshot.last_modified,
+                        content_type=snapshot.content_type,
+                    )
+                    sites_manager.snapshots.put(("json.gz", host), compressed)
+                request.setHeader(b"Content-Encoding", b"gzip")
+                snapshot = compressed
+
+        return serve_snapshot(request, snapshot)
 
-        return template.render(site=site)
+    @app.route("/api/v1/incidents/<service>")  # type: ignore
+    def past_incidents(
+        request: Request, service: str
+    ) -> Union[bytes, resource.ErrorPage]:
+        """
+        Closed incidents of a service, newest first.
+
+        Query arguments: limit, and before, the next cursor of the previous
+        page.
+        """
+        site = get_site(request)
+        if not isinstance(site, SiteManager):
+            return site
+        if service not in site.service_managers:
+            return resource.ErrorPage(
+                404, "Gone cat", '<a href="http://http.cat/404">http://http.cat/404</a>'
+            )
+        before = request.args.get(b"before", [None])[0]
+        try:
+            limit = int(request.args.get(b"limit", [Config.past_incidents_limit])[0])
+            cursor = before.decode("utf-8") if before else None
+        except ValueError:
+            # UnicodeDecodeError, for undecodable cursors, is a ValueError
+            return resource.ErrorPage(
+                400, "Bad cat", '<a href="http://http.cat/400">http://http.cat/400</a>'
+            )
+        limit = max(1, min(limit, MAX_INCIDENTS_PAGE))
+        incidents = site.service_managers[service].incidents.page(limit, cursor)
+        request.setHeader(b"Content-Type", b"application/json")
+        return json.dumps(
+            {
+                "incidents": [incident.to_dict() for incident in incidents],
+                # Only a full page may be followed by another one
+                "next": incidents[-1].cursor if len(incidents) == limit else None,
+            }
+        ).encode("utf-8")
 
     @app.route("/api/v1/alerts", methods=["POST"])  # type: ignore
     def alert_handler(request: Request):
         return AdlerManagerTokenResource(sites_manager)
 
+    if Config.web_metrics:
+
+        @app.route("/metrics")  # type: ignore
+        def metrics(request: Request) -> bytes:
+            request.setHeader(b"Content-Type", b"text/plain; version=0.0.4")
+            return REGISTRY.expose()
+
     @app.route("/static", branch=True)  # type: ignore
     def static_files(request: Request):
         return static.File(Config.web_static_dir)
@@ -11,7 +11,11 @@ from twisted.application import service, strports
 from twisted.python.filepath import FilePath
 from twisted.web import server
 
-from adlermanager import Config, SitesManager, web_root
+from adlermanager.Config import Config
+from adlermanager.ReactorMonitor import ReactorMonitor
+from adlermanager.SitesManager import SitesManager
+from adlermanager.SitesWatcher import SitesWatcher
+from adlermanager.WebRoot import BoundedRequest, web_root
 
 if not FilePath(Config.data_dir).isdir():
     FilePath(Config.data_dir).createDirectory()
@@ -22,8 +26,21 @@ serv_collection = service.IServiceCollection(application)
 # TokenResource
 sites_manager = SitesManager(global_config=Config)
 
+if Config.watch_sites:
+    # Apply changes to sites without restarting
+    watcher = SitesWatcher(
+        sites_manager,
+        debounce=Config.watch_debounce_ms / 1000,
+        poll_interval=Config.watch_poll_seconds,
+    )
+    watcher.setServiceParent(serv_collection)  # type: ignore
+
+if Config.web_metrics:
+    # Measure how long the reactor is blocked
+    ReactorMonitor().setServiceParent(serv_collection)  # type: ignore
+
 resource = web_root(sites_manager)
-site = server.Site(resource)
+site = server.Site(resource, requestFactory=BoundedRequest)
 i = strports.service(Config.web_endpoint, site)  # type: ignore
 i.setServiceParent(serv_collection)  # type: ignore
 
@@ -0,0 +1,221 @@
+"""
+Minimal instrumentation exposed in the Prometheus text format.
+
+All values are updated as things happen, collecting them is cheap.
+"""
+
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(object):
+    """
+    Base class for metrics, see L{Counter}, L{Gauge} and L{Histogram}.
+
+    @cvar type: The Prometheus metric type.
+    @ivar name: Metric name.
+    @ivar documentation: Help text.
+    @ivar labelnames: Names for the values passed as labels when updating.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _labels(self, labels: Labels, extra: Iterable[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+    def expose(self) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        Metric.__init__(self, name, documentation, labelnames, registry)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def remove(self, labels: Labels) -> None:
+        self._values.pop(labels, None)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down.
+
+    Gauges can also be bound to a function that is called on collection,
+    which is useful for values that are already tracked elsewhere.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        Counter.__init__(self, name, documentation, labelnames, registry)
+        self._functions: Dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, labels: Labels = ()) -> None:
+        self._values[labels] = value
+
+    def dec(self, amount: float = 1, labels: Labels = ()) -> None:
+        self.inc(-amount, labels)
+
+    def set_function(self, function: Callable[[], float], labels: Labels = ()) -> None:
+        self._functions[labels] = function
+
+    def get(self, labels: Labels = ()) -> float:
+        if labels in self._functions:
+            return self._functions[labels]()
+        return Counter.get(self, labels)
+
+    def remove(self, labels: Labels) -> None:
+        Counter.remove(self, labels)
+        self._functions.pop(labels, None)
+
+    def samples(self) -> Iterable[str]:
+        yield from Counter.samples(self)
+        for labels, function in self._functions.items():
+            yield f"{self.name}{self._labels(labels)} {_format_value(function())}"
+
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional["Registry"] = None,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        Metric.__init__(self, name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [bucket counts..., sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0.0] * (len(self.buckets) + 1)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-1] += value
+
+    def count(self, labels: Labels = ()) -> int:
+        return int(sum(self._values.get(labels, [0.0])[:-1]))
+
+    def sum(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, [0.0])[-1]
+
+    def samples(self) -> Iterable[str]:
+        for labels, counts in self._values.items():
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = self._labels(labels, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{le} {_format_value(cumulative)}"
+            suffix = self._labels(labels)
+            yield f"{self.name}_sum{suffix} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{suffix} {_format_value(cumulative)}"
+
+
+class Registry(object):
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def expose(self) -> bytes:
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        return (
+            "\n".join(metric.expose() for metric in self._metrics.values()) + "\n"
+        ).encode("utf-8")
+
+
+REGISTRY = Registry()
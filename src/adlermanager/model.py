@@ -1,11 +1,28 @@
+import hashlib
+import json
+import sys
 from datetime import datetime
 from enum import IntEnum
-from typing import Any, Dict, Optional, Union, cast
+from typing import Any, Dict, List, Optional, Union, cast
 
 import attr
 import yaml
 
-from .utils import current_time, read_timestamp
+from .utils import current_time, load_yaml, read_timestamp
+
+ZERO_TIME = "0001-01-01T00:00:00"
+# Always with fractional seconds, see read_timestamp
+_alert_date_format = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+# Labels whose values are shared by many alerts, these are kept only once
+# in memory, as are all label and annotation names
+INTERNED_LABELS = frozenset(
+    {"adlermanager", "service", "component", "severity", "alertname", "heartbeat"}
+)
+# Annotations are free text, only this many are kept per alert, and values
+# are cut to MAX_ANNOTATION_LENGTH characters
+MAX_ANNOTATIONS = 16
+MAX_ANNOTATION_LENGTH = 2048
 
 
 class Severity(IntEnum):
@@ -18,54 +35,241 @@ class Severity(IntEnum):
     def from_string(cls, s: str) -> "Severity":
         # TODO: Do something sensitive with other priorities
         #       At least document them somewhere :-D
-        labels = {
-            "ok": cls.OK,
-            "info": cls.INFO,
-            "warning": cls.WARNING,
-            "error": cls.ERROR,
-            "critical": cls.ERROR,
-        }
-        return labels[s.lower()]
+        severity = _SEVERITY_LABELS.get(s)
+        if severity is None:
+            return _SEVERITY_LABELS[s.lower()]
+        return severity
 
     @classmethod
     def from_alert(cls, alert: "Alert") -> "Severity":
-        if alert.endsAt and alert.endsAt <= current_time():
+        return cls.from_labels(alert.labels, alert.endsAt)
+
+    @classmethod
+    def from_labels(
+        cls,
+        labels: Dict[str, str],
+        endsAt: Optional[datetime] = None,
+        now: Optional[datetime] = None,
+    ) -> "Severity":
+        """
+        @param now: Current time, callers handling many alerts at once pass
+            the same value to all of them.
+        """
+        if endsAt and endsAt <= (now or current_time()):
             return Severity.OK
-        return Severity.from_string(alert.labels.get("severity", "OK"))
+        return Severity.from_string(labels.get("severity", "OK"))
 
     @property
     def css(self) -> str:
-        classes = {self.OK: "success", self.WARNING: "warning", self.ERROR: "danger"}
-        return classes[self]
+        return _SEVERITY_CSS[self]
 
     def __str__(self) -> str:
         return self.css
 
 
-@attr.s
+_SEVERITY_LABELS: Dict[str, Severity] = {
+    "ok": Severity.OK,
+    "info": Severity.INFO,
+    "warning": Severity.WARNING,
+    "error": Severity.ERROR,
+    "critical": Severity.ERROR,
+}
+_SEVERITIES_DESCENDING = sorted(Severity, reverse=True)
+_SEVERITY_CSS: Dict[Severity, str] = {
+    Severity.OK: "success",
+    Severity.INFO: "info",
+    Severity.WARNING: "warning",
+    Severity.ERROR: "danger",
+}
+
+
+@attr.s(slots=True, eq=False)
+class SeverityCounter(object):
+    """
+    How many alerts, or services, have each severity, so the highest one is
+    known without going through all of them.
+
+    A counter with a parent is counted there as one item, with its status;
+    the parent is updated whenever that status changes.
+    This is how component alerts roll up to their service and services to
+    their site.
+
+    @ivar status: Highest severity with a non-zero count, OK if none.
+    """
+
+    parent: Optional["SeverityCounter"] = attr.ib(default=None)
+    status: Severity = attr.ib(default=Severity.OK, init=False)
+    _counts: List[int] = attr.ib(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._counts = [0] * len(Severity)
+        if self.parent is not None:
+            self.parent.add(self.status)
+
+    def __getitem__(self, severity: Severity) -> int:
+        return self._counts[severity]
+
+    def add(self, severity: Severity) -> None:
+        self._counts[severity] += 1
+        self._update()
+
+    def remove(self, severity: Severity) -> None:
+        self._counts[severity] -= 1
+        self._update()
+
+    def replace(self, old: Severity, new: Severity) -> None:
+        if old != new:
+            self._counts[old] -= 1
+            self._counts[new] += 1
+            self._update()
+
+    def clear(self) -> None:
+        self._counts = [0] * len(Severity)
+        self._update()
+
+    def detach(self) -> None:
+        """
+        Stop being counted by our parent.
+        """
+        if self.parent is not None:
+            self.parent.remove(self.status)
+            self.parent = None
+
+    def _update(self) -> None:
+        status = Severity.OK
+        for severity in _SEVERITIES_DESCENDING:
+            if self._counts[severity]:
+                status = severity
+                break
+        if status != self.status:
+            old, self.status = self.status, status
+            if self.parent is not None:
+                self.parent.replace(old, status)
+
+
+def _intern_labels(labels: Dict[str, str]) -> Dict[str, str]:
+    return {
+        sys.intern(k): (
+            sys.intern(v) if k in INTERNED_LABELS and isinstance(v, str) else v
+        )
+        for k, v in labels.items()
+    }
+
+
+def _bound_annotations(annotations: Dict[str, str]) -> Dict[str, str]:
+    bounded: Dict[str, str] = {}
+    for k, v in annotations.items():
+        if len(bounded) >= MAX_ANNOTATIONS:
+            break
+        if isinstance(v, str) and len(v) > MAX_ANNOTATION_LENGTH:
+            v = v[: MAX_ANNOTATION_LENGTH - 1] + "\u2026"
+        bounded[sys.intern(k)] = v
+    return bounded
+
+
+def _read_alert_time(value: Optional[str]) -> Optional[datetime]:
+    # Alertmanager uses Go's zero time for unset timestamps
+    if not value or value.startswith(ZERO_TIME):
+        return None
+    try:
+        return read_timestamp(value)
+    except Exception:
+        return None
+
+
+@attr.s(slots=True, frozen=True)
 class Alert:
+    """
+    An alert as sent by Prometheus or Alertmanager.
+
+    Many alerts are kept around, so they are slotted, common labels are
+    interned and annotations are bounded, see L{Alert.import_alert}.
+    Alerts are immutable, a changed alert is a new alert.
+    """
+
     labels: Dict[str, str] = attr.ib(factory=dict)
     annotations: Dict[str, str] = attr.ib(factory=dict)
     endsAt: Optional[datetime] = attr.ib(default=None)
     startsAt: Optional[datetime] = attr.ib(default=None)
     status: Severity = attr.ib(default=Severity.OK)
+    fingerprint: str = attr.ib(default="")
+    """Identifies an alert across deliveries, see L{Alert.get_fingerprint}"""
+
+    @staticmethod
+    def is_valid(d: Any) -> bool:
+        """
+        Whether d looks like the JSON representation of an alert, so
+        L{Alert.import_alert} can handle it.
+        """
+        if not isinstance(d, dict):
+            return False
+        labels = d.get("labels", {})
+        return (
+            isinstance(labels, dict)
+            and all(isinstance(v, str) for v in labels.values())
+            and isinstance(d.get("annotations", {}), dict)
+        )
+
+    @staticmethod
+    def get_fingerprint(d: Dict[str, Any]) -> str:
+        """
+        Return Alertmanager's fingerprint for an alert or, if it is missing
+        (e.g. when Prometheus sends alerts directly), a hash of its labels.
+        """
+        fingerprint = d.get("fingerprint")
+        if fingerprint:
+            return cast(str, fingerprint)
+        return hashlib.blake2b(
+            json.dumps(d.get("labels", {}), sort_keys=True).encode("utf-8"),
+            digest_size=8,
+        ).hexdigest()
 
     @classmethod
-    def import_alert(cls, d: Dict[str, Any]) -> "Alert":
+    def import_alert(
+        cls,
+        d: Dict[str, Any],
+        fingerprint: str = "",
+        status: Optional[Severity] = None,
+        now: Optional[datetime] = None,
+    ) -> "Alert":
+        """
+        Create an alert from its JSON representation.
+
+        @param status: Use this status instead of the one from the alert's
+            severity and endsAt.
+        @param now: Current time, see L{Severity.from_labels}.
+        """
+        labels = _intern_labels(d.get("labels", dict()))
         # Convert date data types
-        alert = Alert(
-            labels=d.get("labels", dict()),
-            annotations=d.get("annotations", dict()),
+        endsAt = _read_alert_time(d.get("endsAt"))
+        return Alert(
+            labels=labels,
+            annotations=_bound_annotations(d.get("annotations", dict())),
+            endsAt=endsAt,
+            startsAt=_read_alert_time(d.get("startsAt")),
+            # Convert severity (needs date data)
+            status=(
+                Severity.from_labels(labels, endsAt, now) if status is None else status
+            ),
+            fingerprint=fingerprint or Alert.get_fingerprint(d),
         )
+
+    def export_alert(self) -> Dict[str, Any]:
+        """
+        Return the alert as accepted by L{Alert.import_alert}, with its
+        current status.
+        """
+        d: Dict[str, Any] = {
+            "labels": self.labels,
+            "annotations": self.annotations,
+            "fingerprint": self.fingerprint,
+            "status": self.status.name.lower(),
+        }
         for att in ["startsAt", "endsAt"]:
-            if att in d:
-                try:
-                    setattr(alert, att, read_timestamp(cast(str, d[att])))
-                except Exception:
-                    setattr(alert, att, None)
-        # Convert severity (needs date data)
-        alert.status = Severity.from_alert(alert)
-        return alert
+            value = cast(Optional[datetime], getattr(self, att))
+            if value is not None:
+                d[att] = value.strftime(_alert_date_format)
+        return d
 
 
 @attr.s
@@ -107,5 +311,5 @@ class SiteConfig(object):
         Returns:
             SiteConfig: The SiteConfig represented by yaml_string.
         """
-        obj = yaml.safe_load(yaml_string)
+        obj = load_yaml(yaml_string)
         return SiteConfig(**obj)
@@ -1,29 +1,111 @@
-from datetime import datetime, timezone
+import functools
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Generator,
+    List,
+    Match,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
 
 import attr
-from twisted.internet import defer
+import yaml
+from twisted.internet import defer, reactor, task
+from twisted.internet.interfaces import IDelayedCall, IReactorTime
 from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 
+if TYPE_CHECKING:
+    from .Persistence import Persistence
+
 _blessed_date_format = "%Y-%m-%dT%H:%M:%S%z"
 
+# libyaml's loader is much faster, if PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+FileSignature = Tuple[int, int, int]
+"""Modification time in nanoseconds, size and inode number of a file"""
+
 
 @attr.s
 class TimestampFile(object):
+    """
+    A timestamp that is persisted to a file.
+
+    The value is kept in memory, so reading it does no I/O after the first
+    time and writes to disk are coalesced: they happen at most once every
+    flush_interval seconds, see L{TimestampFile.flush}.
+
+    If persistence is passed, writing happens off the reactor thread.
+    """
+
     path: FilePath = attr.ib()
+    persistence: Optional["Persistence"] = attr.ib(default=None)
+    clock: IReactorTime = attr.ib(default=reactor)
+    flush_interval: float = attr.ib(default=5.0)
+    _value: Optional[str] = attr.ib(default=None)
+    """None until read from disk or set"""
+    _dirty: bool = attr.ib(default=False)
+    _flush_call: Optional[IDelayedCall] = attr.ib(default=None)
 
     def set(self, time: datetime) -> None:
-        with self.path.open("w") as f:
-            f.write(time.strftime(_blessed_date_format).encode("utf-8"))
+        self._value = time.strftime(_blessed_date_format)
+        self._dirty = True
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(self.flush_interval, self.flush)
 
     def now(self) -> None:
         self.set(current_time())
 
+    def get(self) -> Optional[datetime]:
+        """
+        @return: None if the timestamp was never set.
+        """
+        value = self.getStr()
+        try:
+            return datetime.strptime(value, _blessed_date_format)
+        except ValueError:
+            return None
+
     def getStr(self) -> str:
-        if not self.path.exists():
-            return ""
-        with self.path.open("r") as f:
-            return f.read().decode("utf-8")
+        if self._value is None:
+            if not self.path.exists():
+                return ""
+            with self.path.open("r") as f:
+                self._value = f.read().decode("utf-8")
+        return self._value
+
+    def flush(self) -> None:
+        """
+        Write the timestamp to disk if it changed since the last flush.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        if not self._dirty or self._value is None:
+            return
+        self._dirty = False
+        content = self._value.encode("utf-8")
+        if self.persistence is None:
+            with self.path.open("w") as f:
+                f.write(content)
+            return
+
+        def failed(failure: Failure) -> None:
+            # Try again next time
+            self._dirty = True
+
+        _ = self.persistence.write(self.path, content).addErrback(failed)
 
 
 def current_time() -> datetime:
@@ -34,9 +116,75 @@ def current_timestamp() -> str:
     return current_time().strftime(_blessed_date_format)
 
 
+@functools.lru_cache(maxsize=4096)
 def read_timestamp(s: str) -> datetime:
-    # We drop nanoseconds as python does not support that
-    return datetime.strptime(f"{s.split('.')[0]}+00:00", _blessed_date_format)
+    """
+    Parse an RFC 3339 timestamp as sent by Alertmanager, e.g.
+    2006-01-02T15:04:05.999999999Z.
+
+    Fractional seconds are dropped, as they were with strptime.
+    Alerts keep being re-sent with the same timestamps, so results are
+    memoised.
+
+    @raises ValueError: If s is not such a timestamp.
+    """
+    if len(s) < 20 or s[4] != "-" or s[7] != "-" or s[13] != ":" or s[16] != ":":
+        raise ValueError(f"Invalid timestamp: {s!r}")
+    if s[10] not in "Tt ":
+        raise ValueError(f"Invalid timestamp: {s!r}")
+    end = 19
+    if s[end] == ".":
+        end += 1
+        while end < len(s) and s[end].isdigit():
+            end += 1
+    offset = s[end:]
+    if offset in ("Z", "z"):
+        tz = timezone.utc
+    elif len(offset) == 6 and offset[0] in "+-" and offset[3] == ":":
+        minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+        tz = timezone(timedelta(minutes=-minutes if offset[0] == "-" else minutes))
+    else:
+        raise ValueError(f"Invalid timestamp: {s!r}")
+    parsed = datetime(
+        int(s[0:4]),
+        int(s[5:7]),
+        int(s[8:10]),
+        int(s[11:13]),
+        int(s[14:16]),
+        int(s[17:19]),
+        tzinfo=tz,
+    )
+    return parsed.astimezone(timezone.utc)
+
+
+def load_yaml(stream: Union[str, bytes, IO[Any]]) -> Any:
+    """
+    Like L{yaml.safe_load}, but with libyaml if available.
+    """
+    return yaml.load(stream, Loader=YamlLoader)  # nosec: B506, this is a safe loader
+
+
+def read_tokens(path: FilePath) -> List[str]:
+    """
+    Read a file with one token per line, it is fine if it doesn't exist.
+    """
+    if not path.exists():
+        return []
+    with open(path.path, "r") as f:
+        return [token for token in (line.strip() for line in f) if token]
+
+
+def file_signature(path: FilePath) -> Optional[FileSignature]:
+    """
+    Return a L{FileSignature} for path, which changes when the file does.
+
+    @return: None if the file doesn't exist.
+    """
+    try:
+        st = os.stat(path.path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
 
 def ensure_dirs(path: FilePath) -> None:
@@ -48,7 +196,107 @@ def default_errback(failure: Failure) -> None:
     pass
 
 
+def noop() -> None:
+    pass
+
+
 def noop_deferred() -> defer.Deferred[None]:
     d: defer.Deferred[None] = defer.Deferred()
     _ = d.addErrback(default_errback)
     return d
+
+
+_json_decoder = json.JSONDecoder()
+_json_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def _json_skip(text: str, idx: int) -> int:
+    return cast(Match[str], _json_whitespace.match(text, idx)).end()
+
+
+def _json_expect(text: str, idx: int, char: str) -> int:
+    if text[idx : idx + 1] != char:
+        raise ValueError(f"Expecting '{char}' at char {idx}")
+    return _json_skip(text, idx + 1)
+
+
+def _iter_json_list(
+    text: str, idx: int, out: List[Any], chunk: int
+) -> Generator[None, None, int]:
+    idx = _json_expect(text, idx, "[")
+    if text[idx : idx + 1] == "]":
+        return idx + 1
+    while True:
+        value, idx = _json_decoder.raw_decode(text, idx)
+        out.append(value)
+        if len(out) % chunk == 0:
+            yield None
+        idx = _json_skip(text, idx)
+        if text[idx : idx + 1] == "]":
+            return idx + 1
+        idx = _json_expect(text, idx, ",")
+
+
+def _iter_json_object(
+    text: str, idx: int, out: Dict[str, Any], chunk: int
+) -> Generator[None, None, int]:
+    idx = _json_expect(text, idx, "{")
+    if text[idx : idx + 1] == "}":
+        return idx + 1
+    while True:
+        if text[idx : idx + 1] != '"':
+            raise ValueError(f"Expecting property name at char {idx}")
+        key, idx = _json_decoder.raw_decode(text, idx)
+        idx = _json_expect(text, _json_skip(text, idx), ":")
+        value: Any
+        if text[idx : idx + 1] == "[":
+            value = []
+            idx = yield from _iter_json_list(text, idx, value, chunk)
+        else:
+            value, idx = _json_decoder.raw_decode(text, idx)
+        out[key] = value
+        idx = _json_skip(text, idx)
+        if text[idx : idx + 1] == "}":
+            return idx + 1
+        idx = _json_expect(text, idx, ",")
+
+
+def _iter_json(text: str, out: List[Any], chunk: int) -> Generator[None, None, None]:
+    idx = _json_skip(text, 0)
+    value: Any
+    if text[idx : idx + 1] == "[":
+        value = []
+        idx = yield from _iter_json_list(text, idx, value, chunk)
+    elif text[idx : idx + 1] == "{":
+        value = {}
+        idx = yield from _iter_json_object(text, idx, value, chunk)
+    else:
+        value, idx = _json_decoder.raw_decode(text, idx)
+    if _json_skip(text, idx) != len(text):
+        raise ValueError(f"Extra data at char {idx}")
+    out.append(value)
+
+
+def decode_json_cooperatively(body: bytes, chunk: int = 100) -> defer.Deferred[Any]:
+    """
+    Decode a JSON document, letting the reactor run in between.
+
+    Top-level lists, and lists in a top-level object, are decoded chunk
+    elements at a time, see L{twisted.internet.task.cooperate}.
+
+    Note that decoding in a thread would not help, as the GIL is held
+    while decoding.
+
+    The encoding is detected as L{json.loads} does for bytes, and errors
+    are reported through the returned Deferred.
+    """
+    out: List[Any] = []
+
+    def cooperate(text: str) -> defer.Deferred[Any]:
+        return task.cooperate(_iter_json(text, out, chunk)).whenDone()
+
+    return (
+        defer.maybeDeferred(body.decode, json.detect_encoding(body), "surrogatepass")
+        .addCallback(cooperate)
+        .addCallback(lambda _: out[0])
+    )